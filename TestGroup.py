@@ -1,21 +1,541 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import Select
-from selenium.common.exceptions import NoSuchElementException, ElementNotVisibleException
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-
-from paramiko import client
-from paramiko.ssh_exception import AuthenticationException, NoValidConnectionsError
-
 import sys
 import time
+
+_import_started = time.time()
+
+import importlib
+import importlib.util
+import argparse
 import os
 import platform
+import json
+import fnmatch
+import threading
+import traceback
+import signal
+import socket
+import random
+import collections
+import io
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class LazyModule:
+    """LazyModule imports module on first access to its attribute, so each
+    command loads only what it uses: selenium for the portal, paramiko for SSH.
+    Submodules are lazy as well, e.g. LazyModule('xml').etree.ElementTree.
+    Import times are collected in LazyModule.loaded.
+    """
+    loaded = {}
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        if self.__module is None:
+            started = time.time()
+            self.__module = importlib.import_module(self.__name)
+            LazyModule.loaded[self.__name] = time.time() - started
+        try:
+            value = getattr(self.__module, attr)
+        except AttributeError:
+            if attr.startswith('__') or importlib.util.find_spec('%s.%s' % (self.__name, attr)) is None:
+                raise
+            value = LazyModule('%s.%s' % (self.__name, attr))
+        setattr(self, attr, value)
+        return value
+
+
+webdriver = LazyModule('selenium.webdriver')
+keys = LazyModule('selenium.webdriver.common.keys')
+by = LazyModule('selenium.webdriver.common.by')
+ui = LazyModule('selenium.webdriver.support.ui')
+EC = LazyModule('selenium.webdriver.support.expected_conditions')
+exceptions = LazyModule('selenium.common.exceptions')
+
+paramiko = LazyModule('paramiko')
+client = LazyModule('paramiko.client')
+ssh_exception = LazyModule('paramiko.ssh_exception')
+fernet = LazyModule('cryptography.fernet')
+
+# Used by VM waits, SSH channels and local commands
+concurrent = LazyModule('concurrent')
+subprocess = LazyModule('subprocess')
+
+# Used by single commands only
+asyncio = LazyModule('asyncio')
+multiprocessing = LazyModule('multiprocessing')
+tempfile = LazyModule('tempfile')
+http = LazyModule('http')
+urllib = LazyModule('urllib')
+xml = LazyModule('xml')
+
+
+# Local record of VMs created by test runs, used to find orphans of crashed runs
+LEDGER_PATH = os.environ.get('TESTGROUP_LEDGER', os.path.join(os.path.expanduser('~'), '.testgroup_ledger.json'))
+
+# Minimal in-VM benchmark results per storage tier ('HDD 1 Type').
+# CPU efficiency is parallel speedup divided by number of vCPUs.
+TIER_THRESHOLDS = {
+    'Ultrafast SSD': {'Random read IOPS': 20000, 'Random write IOPS': 10000, 'Sequential read MB/s': 400,
+                      'Sequential write MB/s': 200, 'CPU efficiency': 0.7},
+    'Fast SSD': {'Random read IOPS': 5000, 'Random write IOPS': 2500, 'Sequential read MB/s': 200,
+                 'Sequential write MB/s': 100, 'CPU efficiency': 0.7},
+    'default': {'Random read IOPS': 200, 'Random write IOPS': 100, 'Sequential read MB/s': 50,
+                'Sequential write MB/s': 30, 'CPU efficiency': 0.7},
+}
+
+# Encrypted store of VM passwords and SSH host keys, and its key file
+# (key may be given in TESTGROUP_STORE_KEY instead)
+STORE_PATH = os.environ.get('TESTGROUP_STORE', os.path.join(os.path.expanduser('~'), '.testgroup_store'))
+STORE_KEY_PATH = os.environ.get('TESTGROUP_STORE_KEY_FILE', STORE_PATH + '.key')
+
+# Resources reserved by VM creations in progress, shared by runs on the host
+ADMISSION_PATH = os.environ.get('TESTGROUP_ADMISSION',
+                                os.path.join(os.path.expanduser('~'), '.testgroup_admission.json'))
+
+# WebDriverWait budgets: page elements and VM status changes
+UI_TIMEOUT = float(os.environ.get('TESTGROUP_UI_TIMEOUT', 30))
+VM_TIMEOUT = float(os.environ.get('TESTGROUP_VM_TIMEOUT', 300))
+
+# Learned test durations, used to estimate remaining time of running tests
+DURATIONS_PATH = os.environ.get('TESTGROUP_DURATIONS',
+                                os.path.join(os.path.expanduser('~'), '.testgroup_durations.json'))
+
+# Scale of harness sleeps and WebDriverWait polling, lowered for time-compressed replay
+TIME_SCALE = 1.0
+
+# Test chains, which can be run independently of each other.
+# Tests inside a chain depend on the previous ones and share VM config.
+SCENARIOS = {
+    'ubuntu': ['test_008', 'benchmark_vm', 'test_011', 'test_012', 'test_firewall'],
+    'centos': ['test_013', 'test_014', 'benchmark_iperf', 'test_firewall'],
+    'all': ['test_008', 'benchmark_vm', 'test_011', 'test_012', 'test_013', 'test_014', 'benchmark_iperf',
+            'test_firewall'],
+}
+
+# Ports opened by firewall rules of VM config ('internet' is outbound only)
+FIREWALL_PORTS = {
+    'SSH': [('tcp', 22)],
+    'web': [('tcp', 80), ('tcp', 443)],
+    'internet': [],
+    'Port 5001 ok': [('tcp', 5001), ('udp', 5001)],
+}
+
+# Ports no rule opens, probed to check that the firewall blocks the rest
+BLOCKED_PROBES = [('tcp', 21), ('tcp', 23), ('tcp', 25), ('tcp', 3306), ('tcp', 5432), ('tcp', 8080),
+                  ('udp', 161)]
+
+# Tests using VM created by another test, skipped if that test did not pass
+DEPENDENCIES = {
+    'benchmark_vm': ['test_008'],
+    'test_011': ['test_008'],
+    'test_012': ['test_008'],
+    'test_014': ['test_013'],
+    'benchmark_iperf': ['test_013'],
+}
+
+
+class HostUnreachableError(Exception):
+    """Raised when host does not respond to ping."""
+    pass
+
+
+class QuotaExceededError(Exception):
+    """Raised when VM does not fit into the account quota."""
+    pass
+
+
+class HostKeyMismatchError(Exception):
+    """Raised when SSH host key differs from the one recorded for the address."""
+    pass
+
+
+class DuplicateVMNameError(Exception):
+    """Raised when VM name matches more than one row of the VM table."""
+    pass
+
+
+class CircuitOpenError(Exception):
+    """Raised when calls to an endpoint are skipped because it keeps failing."""
+    pass
+
+
+class RetryPolicy:
+    """RetryPolicy describes how one class of errors is retried:
+    exponential backoff from base to cap seconds with jitter,
+    at most given number of attempts.
+    """
+
+    def __init__(self, name, errors, attempts, base, cap):
+        self.name = name
+        self.errors = errors
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+
+    def matches(self, error):
+        """Returns True if error belongs to the class. Errors are exception
+        classes or their dotted names; named classes of modules not imported
+        yet are skipped, as error cannot be their instance.
+        """
+        for cls in self.errors:
+            if isinstance(cls, str):
+                module, _, name = cls.rpartition('.')
+                if module not in sys.modules:
+                    continue
+                cls = getattr(sys.modules[module], name)
+            if isinstance(error, cls):
+                return True
+        return False
+
+    def delay(self, attempt):
+        """Returns delay before the next attempt, attempt counts from 1."""
+        delay = min(self.cap, self.base * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
+
+# Retry classes in order of matching (subclasses before base classes)
+RETRY_POLICIES = [
+    # Password may not be set yet right after the first boot
+    RetryPolicy('auth', ('paramiko.ssh_exception.AuthenticationException',), 3, 5, 10),
+    RetryPolicy('refused', ('paramiko.ssh_exception.NoValidConnectionsError', ConnectionRefusedError), 10, 1, 15),
+    RetryPolicy('timeout', (socket.timeout, 'selenium.common.exceptions.TimeoutException'), 3, 2, 30),
+    RetryPolicy('stale element', ('selenium.common.exceptions.StaleElementReferenceException',), 5, 0.1, 1),
+    # E.g. 'Error reading SSH protocol banner' while sshd is starting
+    RetryPolicy('protocol', ('paramiko.ssh_exception.SSHException',), 5, 1, 10),
+    RetryPolicy('unreachable', (HostUnreachableError, OSError), 10, 2, 15),
+]
+
+
+class CircuitBreaker:
+    """CircuitBreaker opens after threshold consecutive failed calls
+    to one endpoint. Calls fail fast while it is open, after reset_timeout
+    seconds a single trial call is let through.
+    """
+
+    def __init__(self, threshold=3, reset_timeout=60):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+
+    def check(self, endpoint):
+        """Raises CircuitOpenError if calls to endpoint are not allowed."""
+        if self.opened is not None:
+            if time.time() - self.opened < self.reset_timeout:
+                raise CircuitOpenError('%s failed %d times in a row' % (endpoint, self.failures))
+            self.opened = None
+
+    def success(self):
+        self.failures = 0
+        self.opened = None
+
+    def failure(self):
+        """Records failed call, returns True if the circuit has opened."""
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened = time.time()
+            return True
+        return False
+
+
+class RetryEngine:
+    """RetryEngine calls functions with retries according to RETRY_POLICIES,
+    deadline budget and per-endpoint circuit breakers, and collects statistics.
+    Endpoint is any string identifying the remote side, e.g. host address.
+    """
+
+    def __init__(self, policies=RETRY_POLICIES, threshold=3, reset_timeout=60):
+        self.policies = policies
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.__breakers = {}
+        self.__stats = {}
+        self.__lock = threading.Lock()
+
+    def policy(self, error):
+        """Returns retry policy for the error or None if it is not retried."""
+        for policy in self.policies:
+            if policy.matches(error):
+                return policy
+        return None
+
+    def __record(self, endpoint, key, retry_class=None, waited=0):
+        with self.__lock:
+            stats = self.__stats.setdefault(endpoint, {'Calls': 0, 'Succeeded': 0, 'Failed': 0, 'Rejected': 0,
+                                                       'Circuit opened': 0, 'Retries': {}, 'Waited': 0.0})
+            if retry_class is None:
+                stats[key] += 1
+            else:
+                stats['Retries'][retry_class] = stats['Retries'].get(retry_class, 0) + 1
+                stats['Waited'] += waited
+
+    def call(self, endpoint, func, *args, deadline=None, **kwargs):
+        """Calls func(*args, **kwargs) with retries and returns its result.
+        Gives up when attempts of the error class are exhausted or the next
+        attempt would start after deadline seconds; the last error is raised.
+        """
+        with self.__lock:
+            breaker = self.__breakers.setdefault(endpoint, CircuitBreaker(self.threshold, self.reset_timeout))
+        self.__record(endpoint, 'Calls')
+        try:
+            breaker.check(endpoint)
+        except CircuitOpenError:
+            self.__record(endpoint, 'Rejected')
+            raise
+        started = time.time()
+        attempts = {}
+        while True:
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                policy = self.policy(e)
+                if policy is None:
+                    raise
+                attempts[policy.name] = attempts.get(policy.name, 0) + 1
+                delay = policy.delay(attempts[policy.name])
+                if attempts[policy.name] >= policy.attempts \
+                        or (deadline is not None and time.time() - started + delay > deadline):
+                    self.__record(endpoint, 'Failed')
+                    if breaker.failure():
+                        self.__record(endpoint, 'Circuit opened')
+                    raise
+                self.__record(endpoint, None, policy.name, delay)
+                time.sleep(delay)
+            else:
+                breaker.success()
+                self.__record(endpoint, 'Succeeded')
+                return result
+
+    def stats(self):
+        """Returns copy of retry statistics by endpoint."""
+        with self.__lock:
+            return json.loads(json.dumps(self.__stats))
+
+    def export(self, path):
+        """Saves retry statistics as JSON."""
+        with open(path, 'w') as f:
+            json.dump(self.stats(), f, indent=1)
+
+
+# Shared retry engine of the process
+RETRY = RetryEngine()
+
+
+class Progress:
+    """Progress keeps live state of the run for the metrics endpoint:
+    VMs in flight with their lifecycle state and time in it, latency of
+    their power transitions, SSH channel
+    queue and pool usage, and elapsed and estimated remaining time of tests.
+    Remaining time is estimated from durations of previous runs.
+    Progress lives in the process, so runs of worker processes (isolated
+    or coordinated) are not served.
+    """
+
+    def __init__(self, durations_path=DURATIONS_PATH):
+        self.durations_path = durations_path
+        self.started = time.time()
+        self.vms = {}
+        self.transitions = {}
+        self.tests = {}
+        self.ssh_queued = 0
+        self.ssh_active = 0
+        self.ssh_capacity = 0
+        self.__learned = {}
+        self.__lock = threading.Lock()
+        try:
+            with open(durations_path) as f:
+                self.durations = json.load(f)
+        except (IOError, ValueError):
+            self.durations = {}
+
+    def vm_state(self, name, state, target=None):
+        """Records lifecycle state of VM, time in state restarts on change."""
+        with self.__lock:
+            vm = self.vms.get(name)
+            if vm is None or vm['State'] != state or vm['Target'] != target:
+                self.vms[name] = {'State': state, 'Target': target, 'Since': time.time()}
+
+    def vm_removed(self, name):
+        with self.__lock:
+            self.vms.pop(name, None)
+
+    def vm_transition(self, name, state_from, state_to, latency):
+        """Records latency of VM power transition, the last one per kind is kept."""
+        with self.__lock:
+            self.transitions[(name, state_from, state_to)] = latency
+
+    def test_started(self, name):
+        with self.__lock:
+            self.tests[name] = {'Status': 'running', 'Started': time.time(), 'Finished': None}
+
+    def test_finished(self, name, status):
+        """Records test result, durations of passed tests are learned."""
+        with self.__lock:
+            test = self.tests[name]
+            test['Status'] = status
+            test['Finished'] = time.time()
+            if status == 'passed':
+                duration = test['Finished'] - test['Started']
+                self.durations[name] = self.__average(self.durations.get(name), duration)
+                self.__learned.setdefault(name, []).append(duration)
+
+    @staticmethod
+    def __average(previous, duration):
+        return duration if previous is None else 0.7 * previous + 0.3 * duration
+
+    def save_durations(self):
+        """Merges durations learned by the run into the file, which other
+        runs may have updated meanwhile.
+        """
+        def merge(durations):
+            for name, learned in self.__learned.items():
+                for duration in learned:
+                    durations[name] = self.__average(durations.get(name), duration)
+            self.__learned.clear()
+            self.durations.update(durations)
+
+        update_json(self.durations_path, self.__lock, merge, default=dict)
+
+    def ssh_channels(self, queued=0, active=0, capacity=None):
+        """Updates SSH channel queue depth and active channels by deltas."""
+        with self.__lock:
+            self.ssh_queued += queued
+            self.ssh_active += active
+            if capacity is not None:
+                self.ssh_capacity = capacity
+
+    def prometheus(self):
+        """Returns metrics in Prometheus text format."""
+        now = time.time()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP testgroup_%s %s' % (name, help_text))
+            lines.append('# TYPE testgroup_%s %s' % (name, kind))
+            for labels, value in samples:
+                label_text = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                      for k, v in sorted(labels.items()))
+                lines.append('testgroup_%s%s %s' % (name, '{%s}' % label_text if label_text else '', value))
+
+        with self.__lock:
+            metric('elapsed_seconds', 'gauge', 'Time since the run started.', [({}, now - self.started)])
+            metric('vms_in_flight', 'gauge', 'VMs created by the run and not destroyed yet.',
+                   [({}, len(self.vms))])
+            metric('vm_state_seconds', 'gauge', 'Time VM spends in its current lifecycle state.',
+                   [({'vm': name, 'state': vm['State'], 'target': vm['Target'] or ''}, now - vm['Since'])
+                    for name, vm in sorted(self.vms.items())])
+            metric('vm_transition_seconds', 'gauge', 'Latency of the last power transition of VM.',
+                   [({'vm': name, 'from': state_from, 'to': state_to}, latency)
+                    for (name, state_from, state_to), latency in sorted(self.transitions.items())])
+            metric('ssh_queue_depth', 'gauge', 'SSH commands waiting for a free channel.', [({}, self.ssh_queued)])
+            metric('ssh_channels_active', 'gauge', 'Open SSH exec channels.', [({}, self.ssh_active)])
+            metric('ssh_pool_utilization', 'gauge', 'Open SSH channels to channel limit ratio.',
+                   [({}, float(self.ssh_active) / self.ssh_capacity if self.ssh_capacity else 0.0)])
+            tests = sorted(self.tests.items(), key=lambda item: item[1]['Started'])
+            metric('test_elapsed_seconds', 'gauge', 'Elapsed time of test.',
+                   [({'test': name, 'status': test['Status']}, (test['Finished'] or now) - test['Started'])
+                    for name, test in tests])
+            metric('test_remaining_seconds', 'gauge', 'Estimated remaining time of running test.',
+                   [({'test': name}, max(0.0, self.durations[name] - (now - test['Started'])))
+                    for name, test in tests if test['Status'] == 'running' and name in self.durations])
+        metric('retries_total', 'counter', 'Retries by endpoint and failure class.',
+               [({'endpoint': endpoint, 'class': retry_class}, count)
+                for endpoint, stats in sorted(RETRY.stats().items())
+                for retry_class, count in sorted(stats['Retries'].items())])
+        return '\n'.join(lines) + '\n'
+
+
+# Live progress of the process
+PROGRESS = Progress()
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """Starts endpoint serving PROGRESS metrics on /metrics in background
+    thread, returns the server.
+    """
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = PROGRESS.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print('Metrics on http://%s:%d/metrics' % (host, server.server_port))
+    return server
+
+
+def parse_metrics(text):
+    """Parses Prometheus text format into list of (name, labels, value)."""
+    samples = []
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        head, value = line.rsplit(' ', 1)
+        name, _, labels = head.partition('{')
+        pairs = [pair.split('=', 1) for pair in labels.rstrip('}').split('",') if pair]
+        samples.append((name, dict((k, v.strip('"')) for k, v in pairs), float(value)))
+    return samples
+
+
+def show_dashboard(url, interval=2, stall_after=VM_TIMEOUT / 2):
+    """Terminal dashboard: polls metrics endpoint of a running TestGroup
+    and redraws run progress. VMs waiting in a transition longer than
+    stall_after seconds are marked as stalled. Stops on Ctrl+C.
+    """
+    def clock(seconds):
+        return '%02d:%02d:%02d' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+    try:
+        while True:
+            try:
+                samples = parse_metrics(urllib.request.urlopen(url, timeout=5).read().decode('utf-8'))
+            except (IOError, ValueError) as e:
+                print('Metrics not available: %s' % e)
+                time.sleep(interval)
+                continue
+            values = dict((name, value) for name, labels, value in samples if not labels)
+            remaining = dict((labels['test'], value) for name, labels, value in samples
+                             if name == 'testgroup_test_remaining_seconds')
+            out = ['\033[2J\033[HTestGroup run, elapsed %s' % clock(values.get('testgroup_elapsed_seconds', 0)), '',
+                   'Tests:']
+            for name, labels, value in samples:
+                if name == 'testgroup_test_elapsed_seconds':
+                    eta = ' remaining ~%s' % clock(remaining[labels['test']]) if labels['test'] in remaining else ''
+                    out.append('  %-16s %-8s elapsed %s%s' % (labels['test'], labels['status'], clock(value), eta))
+            out += ['', 'VMs in flight: %d' % values.get('testgroup_vms_in_flight', 0)]
+            for name, labels, value in samples:
+                if name == 'testgroup_vm_state_seconds':
+                    state = labels['state'] + ('->' + labels['target'] if labels['target'] else '')
+                    stalled = '  STALLED?' if labels['target'] and value > stall_after else ''
+                    out.append('  %-16s %-14s %s%s' % (labels['vm'], state, clock(value), stalled))
+            out += ['', 'SSH: queue %d, channels %d (%.0f%% of pool)' % (
+                values.get('testgroup_ssh_queue_depth', 0), values.get('testgroup_ssh_channels_active', 0),
+                100 * values.get('testgroup_ssh_pool_utilization', 0))]
+            print('\n'.join(out))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
 
 
 def ping(host):
@@ -27,25 +547,249 @@ def ping(host):
     return os.system('ping ' + params + ' ' + host)
 
 
-def send_single_command(address, username, password, command, retries=5, timeout=4):
-    """Establishes SSH-connection and sends single command"""
-    ssh = None
-    count = 0
-    while count < retries:
+def wait_for_ping(host, deadline=60):
+    """Pings host with retries until it responds or deadline is over.
+    Returns 0 if host responded.
+    """
+    def probe():
+        if ping(host) != 0:
+            raise HostUnreachableError(host)
+
+    try:
+        RETRY.call('ping ' + host, probe, deadline=deadline)
+    except (HostUnreachableError, CircuitOpenError):
+        return 1
+    return 0
+
+
+def connect_ssh(address, username, password=None, deadline=120, keystore=None):
+    """Returns connected paramiko client, retrying according to RETRY_POLICIES.
+    Host key is checked against keystore (KEYSTORE by default). Only hosts
+    bound to VMs of the suite are managed: keys of new ones are recorded,
+    and after the first password login the runner key is pushed, so later
+    connections try key authentication first. Other hosts are left as they
+    are and their keys are accepted for the connection only.
+    Password is taken from keystore, if not given.
+    """
+    keystore = keystore or KEYSTORE
+    host = keystore.host(address)
+    owned = host['VM Name'] is not None
+    password = password or host['Password']
+    pkey = keystore.client_key() if username in host['Key auth'] else None
+
+    def connect():
+        ssh = client.SSHClient()
+        if host['Host key'] is not None:
+            entry = paramiko.hostkeys.HostKeyEntry.from_line(host['Host key'])
+            ssh.get_host_keys().add(address, entry.key.get_name(), entry.key)
+        ssh.set_missing_host_key_policy(keystore if owned else client.AutoAddPolicy())
+        try:
+            ssh.connect(hostname=address, username=username, password=password, pkey=pkey,
+                        look_for_keys=False, allow_agent=False)
+        except paramiko.BadHostKeyException as e:
+            # Not retried: the key will not change back
+            raise HostKeyMismatchError('%s (VM destroyed outside of TestGroup?)' % e)
+        return ssh
+
+    ssh = RETRY.call(address, connect, deadline=deadline)
+    if owned and pkey is None:
+        push_key(ssh, address, username, keystore)
+    return ssh
+
+
+def push_key(ssh, address, username, keystore):
+    """Adds runner key to authorized keys of the user, so later connections
+    use key authentication. Failure is not fatal, password still works.
+    """
+    public_key = keystore.public_key()
+    command = "mkdir -p ~/.ssh && chmod 700 ~/.ssh && (grep -qxF '%s' ~/.ssh/authorized_keys 2>/dev/null " \
+              "|| echo '%s' >> ~/.ssh/authorized_keys) && chmod 600 ~/.ssh/authorized_keys" % (public_key, public_key)
+    try:
+        stdin, stdout, stderr = ssh.exec_command(command)
+        data, status = read_channel(stdout.channel)
+    except (ssh_exception.SSHException, OSError):
+        return
+    if status == 0:
+        keystore.key_auth(address, username)
+
+
+class StreamingResult:
+    """StreamingResult gives streaming access to output of remote command.
+    Output is read from the channel in chunks and split into lines on the fly.
+    Only the last keep_bytes of it are retained for failure reports,
+    so memory use does not depend on output size.
+    Channel None stands for a command, which could not be started.
+    """
+
+    def __init__(self, channel, keep_bytes=64 * 1024, chunk_size=32 * 1024, on_close=None):
+        self.channel = channel
+        self.keep_bytes = keep_bytes
+        self.chunk_size = chunk_size
+        self.on_close = on_close
+        self.lines_read = 0
+        self.status = None if channel is not None else -1
+        self.__lines = collections.deque()
+        self.__pending = b''
+        self.__eof = channel is None
+        self.__tail = collections.deque()
+        self.__tail_size = 0
+        self.__truncated = False
+
+    def __read_chunk(self):
+        chunk = self.channel.recv(self.chunk_size)
+        if not chunk:
+            self.__eof = True
+            if self.__pending:
+                self.__lines.append(self.__pending)
+                self.__pending = b''
+            return
+        parts = (self.__pending + chunk).split(b'\n')
+        self.__pending = parts.pop()
+        # Very long line without newline is flushed as is
+        if len(self.__pending) > self.keep_bytes:
+            parts.append(self.__pending)
+            self.__pending = b''
+        self.__lines.extend(parts)
+
+    def __keep(self, line):
+        self.__tail.append(line)
+        self.__tail_size += len(line)
+        while self.__tail_size > self.keep_bytes and len(self.__tail) > 1:
+            self.__tail_size -= len(self.__tail.popleft())
+            self.__truncated = True
+
+    def readline(self):
+        """Returns next line of output or None at the end."""
+        while not self.__lines and not self.__eof:
+            self.__read_chunk()
+        if not self.__lines:
+            return None
+        line = self.__lines.popleft().decode('utf-8', 'replace').rstrip('\r')
+        self.lines_read += 1
+        self.__keep(line)
+        return line
+
+    def __iter__(self):
+        line = self.readline()
+        while line is not None:
+            yield line
+            line = self.readline()
+
+    def find(self, *patterns):
+        """Reads output until a line containing any of patterns.
+        Returns the line, or None if output ended without match.
+        """
+        for line in self:
+            if any(pattern in line for pattern in patterns):
+                return line
+        return None
+
+    def wait(self):
+        """Reads the rest of output and returns exit status."""
+        for _ in self:
+            pass
+        if self.status is None:
+            self.status = int(self.channel.recv_exit_status())
+        self.close()
+        return self.status
+
+    def abort(self):
+        """Stops reading, the rest of output is discarded."""
+        self.close()
+
+    def close(self):
+        if self.channel is not None:
+            self.channel.close()
+        if self.on_close is not None:
+            self.on_close()
+            self.on_close = None
+
+    def output(self):
+        """Returns retained (last) part of output, e.g. for failure report."""
+        text = '\n'.join(self.__tail)
+        return '...\n' + text if self.__truncated else text
+
+
+def open_stream(ssh, command, **kwargs):
+    """Starts command on connected paramiko client and returns StreamingResult.
+    Stderr is merged into the stream, so it can not block the command.
+    """
+    channel = ssh.get_transport().open_session()
+    channel.set_combine_stderr(True)
+    channel.exec_command(command)
+    return StreamingResult(channel, **kwargs)
+
+
+def read_channel(channel):
+    """Reads channel to the end and returns stdout and exit status."""
+    chunks = []
+    chunk = channel.recv(32 * 1024)
+    while chunk:
+        chunks.append(chunk)
+        chunk = channel.recv(32 * 1024)
+    return b''.join(chunks).decode('utf-8', 'replace'), int(channel.recv_exit_status())
+
+
+class MultiplexedExecutor:
+    """MultiplexedExecutor runs several commands at once on one authenticated
+    SSH transport, each in its own exec channel. At most max_channels
+    channels are open at a time (sshd allows 10 sessions by default).
+    """
+
+    def __init__(self, transport, max_channels=4):
+        self.transport = transport
+        self.max_channels = max_channels
+
+    def execute(self, command):
+        """Runs single command in a new channel, returns stdout and exit status."""
+        PROGRESS.ssh_channels(queued=-1, active=1)
         try:
-            ssh = client.SSHClient()
-            ssh.set_missing_host_key_policy(client.AutoAddPolicy())
-            ssh.connect(hostname=address, username=username, password=password)
-            count = retries
-        except NoValidConnectionsError:
-            count += 1
-            time.sleep(timeout)
-    if ssh is None:
+            channel = self.transport.open_session()
+            try:
+                channel.exec_command(command)
+                return read_channel(channel)
+            finally:
+                channel.close()
+        finally:
+            PROGRESS.ssh_channels(active=-1)
+
+    def run(self, commands):
+        """Runs commands concurrently, returns dict of command -> (stdout, exit status)."""
+        commands = list(commands)
+        PROGRESS.ssh_channels(queued=len(commands), capacity=self.max_channels)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_channels, len(commands) or 1)) as pool:
+            return dict(zip(commands, pool.map(self.execute, commands)))
+
+
+def send_single_command(address, username, password, command, deadline=120, keystore=None,
+                        keep_bytes=64 * 1024):
+    """Establishes SSH-connection and sends single command.
+    Returns stdout and exit status; output is streamed and only its last
+    keep_bytes are returned (see StreamingResult), so memory use does not
+    depend on output size.
+    Returns ('', -1) if connection could not be established within deadline.
+    """
+    try:
+        ssh = connect_ssh(address, username, password, deadline, keystore)
+    except (CircuitOpenError, HostKeyMismatchError, ssh_exception.SSHException, OSError):
         return '', -1
     stdin, stdout, stderr = ssh.exec_command(command)
-    data, status = stdout.read(), int(stdout.channel.recv_exit_status())
-    ssh.close()
-    return data, status
+    result = StreamingResult(stdout.channel, keep_bytes=keep_bytes, on_close=ssh.close)
+    status = result.wait()
+    return result.output(), status
+
+
+def stream_single_command(address, username, password, command, deadline=120, keystore=None):
+    """Establishes SSH-connection and starts single command.
+    Returns StreamingResult, the connection is closed together with it.
+    """
+    try:
+        ssh = connect_ssh(address, username, password, deadline, keystore)
+    except (CircuitOpenError, HostKeyMismatchError, ssh_exception.SSHException, OSError):
+        return StreamingResult(None)
+    result = open_stream(ssh, command)
+    result.on_close = ssh.close
+    return result
 
 
 class SSHClient:
@@ -53,24 +797,23 @@ class SSHClient:
     Based on paramiko package
     """
 
-    def __init__(self, address, username, password):
-        self.__client = client.SSHClient()
-        self.__client.set_missing_host_key_policy(client.AutoAddPolicy())
-        try:
-            self.__client.connect(hostname=address, username=username, password=password)
-        except AuthenticationException:
-            print('SSH authentication failed. Please edit "$HOME/.ssh/known_hosts"')
+    def __init__(self, address, username, password, deadline=120, keystore=None):
+        self.__client = connect_ssh(address, username, password, deadline, keystore)
 
     def send_command(self, command):
         """Sends command to remote host and returns stdout and exit status."""
         stdin, stdout, stderr = self.__client.exec_command(command)
-        data = ''
-        while not stdout.channel.exit_status_ready():
-            if stdout.channel.recv_ready():
-                data = stdout.channel.recv(1024)
-                while stdout.channel.recv_ready():
-                    data += stdout.channel.recv(1024)
-        return data, int(stdout.channel.recv_exit_status())
+        return read_channel(stdout.channel)
+
+    def run_parallel(self, commands, max_channels=4):
+        """Runs independent commands concurrently over this connection.
+        Returns dict of command -> (stdout, exit status).
+        """
+        return MultiplexedExecutor(self.__client.get_transport(), max_channels).run(commands)
+
+    def exec(self, command):
+        """Starts command on remote host and returns StreamingResult."""
+        return open_stream(self.__client, command)
 
     def close(self):
         """Closes connection.
@@ -79,22 +822,1323 @@ class SSHClient:
         self.__client.close()
 
     @staticmethod
-    def get_ssh_client(address, username, password, retries=5, timeout=4):
-        """Establishes SSH-connection to remote host with specific number
-        of retries and timeout between them. Returns SSHClient instance or None
+    def get_ssh_client(address, username, password, deadline=120, keystore=None):
+        """Establishes SSH-connection to remote host, retrying with backoff
+        within deadline seconds. Returns SSHClient instance or None
         if connection refused.
         """
-        ssh_client = None
-        count = 0
-        while count < retries:
+        try:
+            return SSHClient(address, username, password, deadline, keystore)
+        except ssh_exception.AuthenticationException:
+            print('SSH authentication to %s failed' % address)
+        except (CircuitOpenError, HostKeyMismatchError, ssh_exception.SSHException, OSError) as e:
+            print('SSH connection to %s failed: %s' % (address, e))
+        return None
+
+
+def webdriver_wait(driver, timeout):
+    """Returns WebDriverWait, which polls faster when replay is time-compressed."""
+    return ui.WebDriverWait(driver, timeout, poll_frequency=max(0.001, 0.5 * TIME_SCALE))
+
+
+def run_local(command, timeout=None):
+    """Runs shell command on the runner and returns stdout and exit status,
+    same as send_single_command does for remote host.
+    """
+    proc = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+    return proc.stdout.decode('utf-8', 'replace'), proc.returncode
+
+
+def parse_iperf_csv(data):
+    """Parses iperf2 report printed with '-y C' option.
+    Returns dict with 'Bandwidth' (Mbit/s), 'Jitter' (ms), 'Loss' (%) and 'Streams'.
+    For UDP the server reports are used, i.e. what actually reached the server.
+    Parallel streams are summed up.
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8', 'replace')
+    streams, sums, reports = [], [], []
+    for line in data.splitlines():
+        fields = line.strip().split(',')
+        if len(fields) < 9:
+            continue
+        if len(fields) >= 14:
+            reports.append(fields)
+        elif fields[5] == '-1':
+            sums.append(fields)
+        else:
+            streams.append(fields)
+
+    result = {'Bandwidth': 0.0, 'Jitter': None, 'Loss': None, 'Streams': 0}
+    if reports:
+        result['Bandwidth'] = sum(float(r[8]) for r in reports) / 1e6
+        result['Jitter'] = max(float(r[9]) for r in reports)
+        lost, total = sum(int(r[10]) for r in reports), sum(int(r[11]) for r in reports)
+        result['Loss'] = 100.0 * lost / total if total else 0.0
+        result['Streams'] = len(reports)
+    elif sums:
+        result['Bandwidth'] = float(sums[-1][8]) / 1e6
+        result['Streams'] = len(streams)
+    elif streams:
+        result['Bandwidth'] = sum(float(r[8]) for r in streams) / 1e6
+        result['Streams'] = len(streams)
+    return result
+
+
+class IperfBenchmark:
+    """IperfBenchmark measures network throughput between two hosts with iperf2.
+    Server and client hosts are given as command runners: functions taking
+    shell command and returning (stdout, exit status), e.g. run_local or
+    send_single_command bound to a VM. Both TCP and UDP servers listen on the same port.
+    """
+
+    def __init__(self, server_address, server_run=run_local, client_run=run_local, port=5001):
+        self.server_address = server_address
+        self.server_run = server_run
+        self.client_run = client_run
+        self.port = port
+
+    def start_server(self, lifetime=300):
+        """Starts TCP and UDP iperf servers in background.
+        Servers stop by themselves after lifetime seconds.
+        """
+        for proto in ('', ' -u'):
+            self.server_run('nohup timeout %d iperf -s%s -p %d > /dev/null 2>&1 &' % (lifetime, proto, self.port))
+        time.sleep(1)
+
+    def stop_server(self):
+        """Stops iperf servers started by start_server."""
+        self.server_run("pkill -f '[i]perf -s.* -p %d'" % self.port)
+
+    def measure(self, udp=False, streams=4, duration=10, bandwidth=None):
+        """Runs iperf client and returns parsed result (see parse_iperf_csv).
+        For UDP, bandwidth is the target send rate in Mbit/s.
+        """
+        command = 'iperf -c %s -p %d -t %d -P %d -y C' % (self.server_address, self.port, duration, streams)
+        if udp:
+            command += ' -u -b %sM' % (float(bandwidth or 1) / streams)
+        data, status = self.client_run(command)
+        assert 0 == status, 'iperf client failed: %s' % data
+        return parse_iperf_csv(data)
+
+    def run(self, bandwidth, streams=4, duration=10, tolerance=0.9, max_loss=1.0):
+        """Measures TCP and UDP throughput and checks it against configured
+        bandwidth (Mbit/s). Returns dict with 'TCP' and 'UDP' results.
+        Fails if UDP loss is unknown, i.e. the server report is missing.
+        """
+        self.start_server(lifetime=2 * duration + 60)
+        try:
+            results = {'TCP': self.measure(False, streams, duration),
+                       'UDP': self.measure(True, streams, duration, bandwidth)}
+        finally:
+            self.stop_server()
+
+        tcp, udp = results['TCP'], results['UDP']
+        print('\tTCP: %.1f Mbit/s, %d streams' % (tcp['Bandwidth'], tcp['Streams']))
+        print('\tUDP: %.1f Mbit/s, %d streams, jitter %s ms, loss %s %%' %
+              (udp['Bandwidth'], udp['Streams'], udp['Jitter'], udp['Loss']))
+        assert results['TCP']['Bandwidth'] >= tolerance * float(bandwidth), \
+            'TCP bandwidth %.1f < %s Mbit/s' % (results['TCP']['Bandwidth'], bandwidth)
+        assert results['UDP']['Loss'] is not None, 'no UDP server report (server not reached?)'
+        assert results['UDP']['Loss'] <= max_loss, 'UDP loss %.2f%% > %s%%' % (results['UDP']['Loss'], max_loss)
+        return results
+
+
+class VMBenchmark:
+    """VMBenchmark runs disk and CPU benchmarks inside a VM.
+    Disk is measured with fio (installed if missing), CPU throughput is
+    measured by hashing a stream on one core and on all cores in parallel.
+    The VM is given as command runner, see IperfBenchmark.
+    """
+
+    def __init__(self, run, filename='/root/benchmark.tmp', size='512M', runtime=15):
+        self.run = run
+        self.filename = filename
+        self.size = size
+        self.runtime = runtime
+
+    def output(self, command):
+        """Runs command and returns its stdout as text."""
+        data, status = self.run(command)
+        assert 0 == status, '%s failed: %s' % (command, data)
+        return data.decode('utf-8', 'replace') if isinstance(data, bytes) else data
+
+    def fio(self, rw, bs):
+        """Runs single fio job and returns (IOPS, MB/s)."""
+        data = self.output('fio --name=%s --filename=%s --size=%s --direct=1 --ioengine=libaio --iodepth=32 '
+                           '--rw=%s --bs=%s --runtime=%d --time_based --output-format=json'
+                           % (rw, self.filename, self.size, rw, bs, self.runtime))
+        job = json.loads(data[data.index('{'):])['jobs'][0]
+        side = job['write' if 'write' in rw else 'read']
+        return side['iops'], side['bw'] / 1024.0
+
+    def disk(self):
+        """Measures sequential and random IO."""
+        self.run('command -v fio || yum -y install fio || apt-get -y install fio')
+        try:
+            result = {
+                'Sequential read MB/s': self.fio('read', '1M')[1],
+                'Sequential write MB/s': self.fio('write', '1M')[1],
+                'Random read IOPS': self.fio('randread', '4k')[0],
+                'Random write IOPS': self.fio('randwrite', '4k')[0],
+            }
+        finally:
+            self.run('rm -f %s' % self.filename)
+        return result
+
+    def cpu(self, megabytes=512):
+        """Measures hashing throughput on one core and on all cores.
+        Returns single core and total MB/s, speedup and efficiency.
+        """
+        vcpus = int(self.output('nproc').strip())
+        job = '(dd if=/dev/zero bs=1M count=%d 2>/dev/null | md5sum > /dev/null) &' % megabytes
+
+        def elapsed(copies):
+            data = self.output('s=$(date +%%s.%%N); for i in $(seq %d); do %s done; wait; echo $s $(date +%%s.%%N)'
+                               % (copies, job))
+            start, end = data.split()[-2:]
+            return float(end) - float(start)
+
+        single = megabytes / elapsed(1)
+        total = vcpus * megabytes / elapsed(vcpus)
+        return {'vCPU': vcpus, 'Single core MB/s': single, 'All cores MB/s': total,
+                'CPU speedup': total / single, 'CPU efficiency': total / single / vcpus}
+
+    @staticmethod
+    def check(results, tier):
+        """Returns list of results below thresholds of given storage tier."""
+        thresholds = TIER_THRESHOLDS.get(tier, TIER_THRESHOLDS['default'])
+        return ['%s: %.2f < %s' % (name, results[name], minimum)
+                for name, minimum in sorted(thresholds.items()) if results[name] < minimum]
+
+
+class UDPProbe:
+    """Datagram protocol of scan_ports: a reply means 'open', ICMP port
+    unreachable means 'closed', silence leaves the future unresolved.
+    """
+
+    def __init__(self, future):
+        self.future = future
+
+    def connection_made(self, transport):
+        transport.sendto(b'\r\n')
+
+    def datagram_received(self, data, addr):
+        if not self.future.done():
+            self.future.set_result('open')
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_result('closed' if isinstance(exc, ConnectionRefusedError) else 'filtered')
+
+    def connection_lost(self, exc):
+        pass
+
+
+async def probe_port(host, protocol, port, timeout):
+    """Returns state of one port: 'open', 'closed' (reachable, nothing listens),
+    'filtered' (no answer to TCP) or 'open|filtered' (no answer to UDP).
+    """
+    loop = asyncio.get_running_loop()
+    if protocol == 'tcp':
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        except ConnectionRefusedError:
+            return 'closed'
+        except (asyncio.TimeoutError, OSError):
+            return 'filtered'
+        writer.close()
+        return 'open'
+    future = loop.create_future()
+    try:
+        transport, _ = await loop.create_datagram_endpoint(lambda: UDPProbe(future), remote_addr=(host, port))
+    except OSError:
+        return 'filtered'
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        return 'open|filtered'
+    finally:
+        transport.close()
+
+
+def scan_ports(targets, timeout=1.0, concurrency=256):
+    """Probes (host, protocol, port) targets concurrently, at most concurrency
+    at once, and returns dict of target -> state (see probe_port).
+    """
+    async def scan():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def probe(target):
+            async with semaphore:
+                return await probe_port(*target, timeout=timeout)
+
+        return await asyncio.gather(*[probe(target) for target in targets])
+
+    targets = list(targets)
+    return dict(zip(targets, asyncio.run(scan())))
+
+
+def expected_ports(rules):
+    """Returns sets of (protocol, port) allowed and blocked by firewall
+    rules given as in VM config: [(rule name, enabled)].
+    """
+    allowed = set()
+    for name, enabled in rules:
+        if enabled:
+            allowed.update(FIREWALL_PORTS.get(name, []))
+    probed = set(port for ports in FIREWALL_PORTS.values() for port in ports) | set(BLOCKED_PROBES)
+    return allowed, probed - allowed
+
+
+def verify_firewalls(vms, timeout=1.0):
+    """Scans ports of VMs given as dict of address -> firewall rules in one pass.
+    Returns dict of address -> {'Ports': {'<protocol>/<port>': state}, 'Mismatches': [...]}.
+    Allowed port mismatches if it does not answer at all, blocked one if it is open.
+    """
+    expected = dict((address, expected_ports(rules)) for address, rules in vms.items())
+    targets = [(address, protocol, port) for address, (allowed, blocked) in sorted(expected.items())
+               for protocol, port in sorted(allowed | blocked)]
+    states = scan_ports(targets, timeout)
+    results = dict((address, {'Ports': {}, 'Mismatches': []}) for address in vms)
+    for (address, protocol, port), state in sorted(states.items()):
+        allowed, blocked = expected[address]
+        name = '%s/%d' % (protocol, port)
+        results[address]['Ports'][name] = state
+        if (protocol, port) in allowed and state == 'filtered':
+            results[address]['Mismatches'].append('%s allowed, but %s' % (name, state))
+        elif (protocol, port) in blocked and state == 'open':
+            results[address]['Mismatches'].append('%s blocked, but %s' % (name, state))
+    return results
+
+
+def pid_alive(pid):
+    """Checks whether process with given id exists on this host.
+    Always True on Windows, where signal 0 would kill the process.
+    """
+    if platform.system().lower() == 'windows':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def update_json(path, lock, func, default=list, shared=False, decode=None, encode=None):
+    """Loads JSON document from path (default() if the file is empty or
+    missing), applies func to it and saves the result; returns what func
+    returns. The file is locked with flock, so several runs on one host may
+    share it, and lock serializes threads of the process.
+    With shared=True the document is only read under a shared lock.
+    decode and encode transform file content (bytes), e.g. to encrypt it.
+    """
+    with lock:
+        try:
+            f = open(path, 'rb' if shared else 'a+b')
+        except FileNotFoundError:
+            return func(default())
+        with f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            f.seek(0)
+            content = f.read()
+            if content.strip():
+                document = json.loads((decode(content) if decode else content).decode('utf-8'))
+            else:
+                document = default()
+            result = func(document)
+            if not shared:
+                content = json.dumps(document, indent=1).encode('utf-8')
+                f.seek(0)
+                f.truncate()
+                f.write(encode(content) if encode else content)
+            return result
+
+
+class RunLedger:
+    """RunLedger is a local JSON record of VMs created by test runs.
+    Every entry keeps the VM name, the VM id (once known), the run tag,
+    the host and the process id of the run, so VMs left behind by crashed
+    runs can be found later. VM names are fixed and may be reused by other
+    runners of the account, so left VMs are found by id only.
+    """
+
+    def __init__(self, path=LEDGER_PATH, run_tag=None):
+        self.path = path
+        self.host = platform.node()
+        self.pid = os.getpid()
+        self.run_tag = run_tag or '%s-%d-%d-%s' % (self.host, self.pid, int(time.time()), os.urandom(2).hex())
+        self.__lock = threading.Lock()
+
+    def __update(self, func, shared=False):
+        """Applies func to the entries, see update_json."""
+        return update_json(self.path, self.__lock, func, shared=shared)
+
+    def add(self, vm_name):
+        """Records VM created by the current run."""
+        entry = {'VM Name': vm_name, 'VM id': None, 'Run': self.run_tag, 'Host': self.host, 'Pid': self.pid,
+                 'Created': time.time()}
+        self.__update(lambda entries: entries.append(entry))
+
+    def identify(self, vm_name, vm_id):
+        """Records id of VM created by the current run, once it is known."""
+        def identify(entries):
+            for e in entries:
+                if e['Run'] == self.run_tag and e['VM Name'] == vm_name and not e.get('VM id'):
+                    e['VM id'] = vm_id
+
+        self.__update(identify)
+
+    def remove(self, vm_names, run_tags=None):
+        """Forgets given VMs, e.g. after they were destroyed.
+        If run_tags are given, only entries of these runs are forgotten.
+        """
+        vm_names = set(vm_names)
+
+        def forget(entries):
+            entries[:] = [e for e in entries
+                          if e['VM Name'] not in vm_names or (run_tags is not None and e['Run'] not in run_tags)]
+
+        self.__update(forget)
+
+    def discard(self, discarded):
+        """Forgets given entries (as returned by entries())."""
+        def forget(entries):
+            entries[:] = [e for e in entries if e not in discarded]
+
+        self.__update(forget)
+
+    def entries(self, run_tag=None):
+        """Returns ledger entries, optionally only of the given run."""
+        entries = self.__update(list, shared=True)
+        return [e for e in entries if run_tag is None or e['Run'] == run_tag]
+
+    def is_orphan(self, entry, max_age=6 * 3600):
+        """Checks whether entry is left by another run, which is not running anymore.
+        A run is considered dead if its process is gone (same host only)
+        or its VM is older than max_age seconds.
+        """
+        if entry['Run'] == self.run_tag:
+            return False
+        return time.time() - entry['Created'] > max_age \
+            or (entry['Host'] == self.host and not pid_alive(entry['Pid']))
+
+    def orphans(self, max_age=6 * 3600):
+        """Returns entries of VMs left by dead runs."""
+        return [e for e in self.entries() if self.is_orphan(e, max_age)]
+
+
+class CredentialStore:
+    """CredentialStore is an encrypted local record of VM passwords,
+    SSH host keys and the runner's own SSH key.
+    Host keys are trusted on first use: the key presented at the first
+    connection to an address is recorded and later connections must present
+    the same key. Entries are dropped when VMs are destroyed, and when an
+    address is bound to another VM, so recycled IPs start afresh.
+    The file is encrypted with Fernet key from TESTGROUP_STORE_KEY or the key
+    file (created on first use) and locked, so several runs may share it.
+    Scratch stores (e.g. of a replay) may be kept unencrypted.
+    """
+
+    def __init__(self, path=STORE_PATH, key_path=None, encrypted=True):
+        self.path = path
+        self.key_path = key_path or path + '.key'
+        self.encrypted = encrypted
+        self.__cipher = None
+        self.__client_key = None
+        self.__lock = threading.Lock()
+
+    def __fernet(self):
+        if self.__cipher is None:
+            key = os.environ.get('TESTGROUP_STORE_KEY')
+            if key is None:
+                new_key = fernet.Fernet.generate_key()
+                try:
+                    fd = os.open(self.key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                except FileExistsError:
+                    with open(self.key_path, 'rb') as f:
+                        key = f.read().strip()
+                else:
+                    key = new_key
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(key)
+            self.__cipher = fernet.Fernet(key)
+        return self.__cipher
+
+    def __update(self, func, shared=False):
+        """Applies func to the decrypted store, see update_json."""
+        return update_json(self.path, self.__lock, func,
+                           default=lambda: {'Client key': None, 'Hosts': {}, 'Credentials': {}}, shared=shared,
+                           decode=(lambda content: self.__fernet().decrypt(content)) if self.encrypted else None,
+                           encode=(lambda content: self.__fernet().encrypt(content)) if self.encrypted else None)
+
+    def add_credentials(self, vm_name, username, password, key_pushed=False):
+        """Records credentials of VM being created."""
+        def add(data):
+            data['Credentials'][vm_name] = {'Username': username, 'Password': password,
+                                            'Key auth': [username] if key_pushed else []}
+
+        self.__update(add)
+
+    def bind(self, address, vm_name):
+        """Binds address to VM. Host key recorded for the address belongs
+        to a previous VM (recycled IP), if it was bound to another one.
+        """
+        def bind(data):
+            host = data['Hosts'].get(address)
+            if host is None or host['VM Name'] != vm_name:
+                data['Hosts'][address] = {'VM Name': vm_name, 'Host key': None, 'Added': time.time()}
+
+        self.__update(bind)
+
+    def forget(self, vm_names=(), addresses=()):
+        """Drops host keys and credentials of destroyed VMs."""
+        def forget(data):
+            for address, host in list(data['Hosts'].items()):
+                if address in addresses or host['VM Name'] in vm_names:
+                    del data['Hosts'][address]
+            for name in list(vm_names) + list(addresses):
+                data['Credentials'].pop(name, None)
+
+        self.__update(forget)
+
+    def host(self, address):
+        """Returns dict with 'VM Name' bound to the address (None if not
+        bound), known_hosts line of 'Host key', 'Password' and usernames with
+        'Key auth' of the address.
+        """
+        def lookup(data):
+            host = data['Hosts'].get(address, {})
+            credentials = data['Credentials'].get(host.get('VM Name') or address, {})
+            return {'VM Name': host.get('VM Name'), 'Host key': host.get('Host key'),
+                    'Password': credentials.get('Password'), 'Key auth': credentials.get('Key auth', [])}
+
+        return self.__update(lookup, shared=True)
+
+    def key_auth(self, address, username):
+        """Records that runner key is authorized for the user on the host."""
+        def add(data):
+            host = data['Hosts'].get(address, {})
+            credentials = data['Credentials'].setdefault(host.get('VM Name') or address,
+                                                         {'Username': username, 'Password': None, 'Key auth': []})
+            if username not in credentials['Key auth']:
+                credentials['Key auth'].append(username)
+
+        self.__update(add)
+
+    def missing_host_key(self, ssh, hostname, key):
+        """paramiko host key policy: records key of the host seen for the first time."""
+        def record(data):
+            host = data['Hosts'].setdefault(hostname, {'VM Name': None, 'Host key': None, 'Added': time.time()})
+            host['Host key'] = '%s %s %s' % (hostname, key.get_name(), key.get_base64())
+
+        self.__update(record)
+        ssh.get_host_keys().add(hostname, key.get_name(), key)
+
+    def client_key(self):
+        """Returns SSH key of the runner, generated on first use."""
+        if self.__client_key is None:
+            def load(data):
+                if data['Client key'] is None:
+                    pem = io.StringIO()
+                    paramiko.ECDSAKey.generate().write_private_key(pem)
+                    data['Client key'] = pem.getvalue()
+                return data['Client key']
+
+            self.__client_key = paramiko.ECDSAKey.from_private_key(io.StringIO(self.__update(load)))
+        return self.__client_key
+
+    def public_key(self):
+        """Returns authorized_keys line of the runner key."""
+        key = self.client_key()
+        return '%s %s testgroup' % (key.get_name(), key.get_base64())
+
+
+# Credentials and host keys shared by all connections of the process
+KEYSTORE = CredentialStore(STORE_PATH, STORE_KEY_PATH)
+
+
+def parse_quota(raw):
+    """Normalizes quota object found on the page into dict of
+    resource -> (limit, used). Resources are 'vCPU', 'RAM' (MB) and 'HDD' (GB),
+    values are numbers or objects with limit ('limit', 'max', 'total') and 'used'.
+    used is None if the page does not report usage of the resource.
+    """
+    names = {'vcpu': 'vCPU', 'vcpus': 'vCPU', 'cpu': 'vCPU', 'cpus': 'vCPU', 'cores': 'vCPU',
+             'ram': 'RAM', 'memory': 'RAM', 'hdd': 'HDD', 'disk': 'HDD', 'storage': 'HDD'}
+    quota = {}
+    for key, value in raw.items():
+        resource = names.get(key.lower())
+        if resource is None:
+            continue
+        if isinstance(value, dict):
+            limit = next((value[k] for k in ('limit', 'max', 'total') if value.get(k) is not None), None)
+            used = value.get('used')
+        else:
+            limit, used = value, None
+        if limit is not None:
+            quota[resource] = (float(limit), None if used is None else float(used))
+    return quota
+
+
+def vm_demand(config):
+    """Returns resources requested by VM config, see parse_quota."""
+    return {'vCPU': float(config.get('vCPU', 0)), 'RAM': float(config.get('RAM', 0)),
+            'HDD': float(config.get('HDD 1 Size', 0))}
+
+
+class AdmissionController:
+    """AdmissionController admits VM creations of an account only within its
+    quota. Limits and usage are read from the portal page (Backend and page
+    globals); creations admitted but not counted in usage yet are reserved
+    in a file shared by all runs on the host, so parallel runs of one account
+    do not oversubscribe it. If the page does not report usage, reservations
+    are kept until the VMs are destroyed.
+    A request, which does not fit, waits until enough is freed (smaller
+    requests may go first); a request larger than the whole quota fails at once.
+    TESTGROUP_QUOTA (e.g. 'vCPU=32,RAM=65536') overrides the limits.
+    Without a quota on the page or the override, admission control is disabled.
+    """
+
+    QUOTA_SCRIPT = """
+        var sources = [window.quota, window.Backend && Backend.quota, window.Backend && Backend.limits,
+                       window.account && account.quota, window.user && user.quota, window.instance_limits];
+        for (var i = 0; i < sources.length; i++) {
+            if (sources[i] && typeof sources[i] === 'object') return JSON.stringify(sources[i]);
+        }
+        return null;
+        """
+
+    def __init__(self, driver, account, path=ADMISSION_PATH, poll_interval=5, reservation_ttl=VM_TIMEOUT):
+        self.driver = driver
+        self.account = account
+        self.path = path
+        self.poll_interval = poll_interval
+        self.reservation_ttl = reservation_ttl
+        self.host = platform.node()
+        self.pid = os.getpid()
+        self.__warned = False
+        self.__lock = threading.Lock()
+
+    def quota(self):
+        """Returns quota of the account (see parse_quota), empty if unknown."""
+        raw = self.driver.execute_script(self.QUOTA_SCRIPT)
+        quota = parse_quota(json.loads(raw)) if raw else {}
+        for item in os.environ.get('TESTGROUP_QUOTA', '').split(','):
+            if '=' in item:
+                resource, limit = [part.strip() for part in item.split('=', 1)]
+                quota[resource] = (float(limit), quota.get(resource, (0, None))[1])
+        if not quota and not self.__warned:
+            print('\tWarning: quota of %s not found on the page, admission control disabled '
+                  '(set TESTGROUP_QUOTA)' % self.account)
+            self.__warned = True
+        return quota
+
+    def __update(self, func):
+        """Applies func to the reservations, see update_json."""
+        def prune(entries):
+            # Reservations of dead runs and creations, which never completed
+            entries[:] = [e for e in entries if (e.get('Created') or time.time() - e['Reserved'] < self.reservation_ttl)
+                          and (e['Host'] != self.host or pid_alive(e['Pid']))]
+            return func(entries)
+
+        return update_json(self.path, self.__lock, prune)
+
+    def admit(self, name, demand, deadline=VM_TIMEOUT, vm_name=None):
+        """Waits until demand (dict resource -> amount) fits into the quota
+        and reserves it under name for VM vm_name (name by default), until
+        created(name) if the page counts the usage, otherwise until
+        release(vm_name) once the VM is destroyed.
+        Raises QuotaExceededError if demand exceeds the whole quota
+        or does not fit within deadline seconds.
+        """
+        started = time.time()
+        waiting = False
+        while True:
+            quota = self.quota()
+            needed = dict((r, amount) for r, amount in demand.items() if r in quota and amount > 0)
+            for resource, amount in needed.items():
+                if amount > quota[resource][0]:
+                    raise QuotaExceededError('%s needs %g %s, quota is %g' % (name, amount, resource,
+                                                                              quota[resource][0]))
+
+            def reserve(entries):
+                reserved = [e for e in entries if e['Account'] == self.account]
+                for resource, amount in needed.items():
+                    limit, used = quota[resource]
+                    if (used or 0) + sum(e['Demand'].get(resource, 0) for e in reserved) + amount > limit:
+                        return resource
+                entries.append({'Account': self.account, 'Name': name, 'VM Name': vm_name or name,
+                                'Demand': needed, 'Counted': all(quota[r][1] is not None for r in needed),
+                                'Created': False, 'Host': self.host, 'Pid': self.pid, 'Reserved': time.time()})
+                return None
+
+            short = self.__update(reserve)
+            if short is None:
+                return time.time() - started
+            if time.time() - started > deadline:
+                raise QuotaExceededError('%s: not enough %s in quota after %ss' % (name, short, deadline))
+            if not waiting:
+                print('\tWaiting for %s quota...' % short)
+                waiting = True
+            time.sleep(self.poll_interval * TIME_SCALE)
+
+    def created(self, *names):
+        """Marks reservations as completed: they are dropped if the page
+        counts them in usage, otherwise kept until the VM is destroyed.
+        """
+        names = set(names)
+
+        def created(entries):
+            mine = [e for e in entries if e['Account'] == self.account and e['Name'] in names
+                    and e['Host'] == self.host and e['Pid'] == self.pid]
+            for entry in mine:
+                entry['Created'] = True
+            entries[:] = [e for e in entries if not (e in mine and e['Counted'])]
+
+        self.__update(created)
+
+    def release(self, *vm_names):
+        """Drops all reservations of VMs, once they are destroyed."""
+        vm_names = set(vm_names)
+
+        def release(entries):
+            entries[:] = [e for e in entries if not (e['Account'] == self.account and e['VM Name'] in vm_names)]
+
+        self.__update(release)
+
+
+class Remote:
+    """Remote groups operations on VMs and the runner network (ping, SSH,
+    local commands) used by the tests, so they can be recorded and replayed
+    together with the WebDriver session. SSH uses credentials and host keys
+    of keystore.
+    """
+
+    def __init__(self, keystore=None):
+        self.keystore = keystore or KEYSTORE
+
+    @staticmethod
+    def ping(host, deadline=60):
+        return wait_for_ping(host, deadline)
+
+    def send_single_command(self, address, username, password, command):
+        return send_single_command(address, username, password, command, keystore=self.keystore)
+
+    def stream_single_command(self, address, username, password, command):
+        return stream_single_command(address, username, password, command, keystore=self.keystore)
+
+    def get_ssh_client(self, address, username, password):
+        return SSHClient.get_ssh_client(address, username, password, keystore=self.keystore)
+
+    def public_key(self):
+        """Returns runner key, recorded so replay types the same key."""
+        return self.keystore.public_key()
+
+    @staticmethod
+    def run_local(command):
+        return run_local(command)
+
+
+# Exceptions, which are raised again in replay with their own type
+REPLAY_EXCEPTIONS = dict((path.rpartition('.')[2], path) for path in (
+    'selenium.common.exceptions.NoSuchElementException', 'selenium.common.exceptions.ElementNotVisibleException',
+    'selenium.common.exceptions.StaleElementReferenceException', 'selenium.common.exceptions.TimeoutException',
+    'selenium.common.exceptions.WebDriverException', 'paramiko.ssh_exception.AuthenticationException',
+    'paramiko.ssh_exception.NoValidConnectionsError', 'paramiko.ssh_exception.SSHException',
+    'builtins.AssertionError'))
+
+
+class ReplayMismatchError(Exception):
+    """Raised when replayed harness does not call what was recorded."""
+    pass
+
+
+class Recorder:
+    """Recorder writes every call to recorded objects (WebDriver, Remote and
+    objects returned by them) with result and timing as JSON lines.
+    Objects which are not JSON serializable (e.g. web elements) are recorded
+    as references and recorded in turn.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.started = time.time()
+        self.__count = 0
+        self.__lock = threading.Lock()
+
+    def wrap(self, name, factory):
+        """Creates object with factory and returns its recording proxy."""
+        return RecordingProxy(factory(), self, name)
+
+    def ref(self, value):
+        """Returns JSON form of value, proxies are written as references."""
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if isinstance(value, RecordingProxy):
+            return {'Ref': value._name}
+        if isinstance(value, (list, tuple)):
+            return [self.ref(v) for v in value]
+        if isinstance(value, dict):
+            return dict((str(k), self.ref(v)) for k, v in value.items())
+        return repr(value)
+
+    def proxy(self, value):
+        """Returns value with non serializable objects replaced by proxies."""
+        if value is None or isinstance(value, (bool, int, float, str, RecordingProxy)):
+            return value
+        if isinstance(value, (list, tuple)):
+            return type(value)(self.proxy(v) for v in value)
+        if isinstance(value, dict):
+            return dict((k, self.proxy(v)) for k, v in value.items())
+        with self.__lock:
+            self.__count += 1
+            name = '%s:%d' % (type(value).__name__, self.__count)
+        return RecordingProxy(value, self, name)
+
+    def write(self, entry):
+        with self.__lock:
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class RecordingProxy:
+    """RecordingProxy passes attribute access and method calls to the target
+    and records them with Recorder.
+    """
+
+    def __init__(self, target, recorder, name):
+        self._target = target
+        self._recorder = recorder
+        self._name = name
+
+    def __getattr__(self, attr):
+        recorder = self._recorder
+        started = time.time()
+        value = getattr(self._target, attr)
+        if not callable(value):
+            value = recorder.proxy(value)
+            recorder.write({'Target': self._name, 'Attr': attr, 'Offset': started - recorder.started,
+                            'Elapsed': time.time() - started, 'Result': recorder.ref(value)})
+            return value
+
+        def call(*args, **kwargs):
+            entry = {'Target': self._name, 'Call': attr, 'Args': recorder.ref(args), 'Kwargs': recorder.ref(kwargs)}
+            args = [a._target if isinstance(a, RecordingProxy) else a for a in args]
+            started = time.time()
+            entry['Offset'] = started - recorder.started
+            try:
+                result = recorder.proxy(value(*args, **kwargs))
+            except Exception as e:
+                entry.update({'Elapsed': time.time() - started, 'Error': type(e).__name__, 'Message': str(e)})
+                recorder.write(entry)
+                raise
+            entry.update({'Elapsed': time.time() - started, 'Result': recorder.ref(result)})
+            recorder.write(entry)
+            return result
+
+        return call
+
+
+class Player:
+    """Player serves calls recorded by Recorder in the same order.
+    Recorded time of every call is slept scaled by time_scale:
+    1 reproduces recorded timing, 0 measures the harness alone.
+    """
+
+    def __init__(self, path, time_scale=0.0):
+        with open(path) as f:
+            self.entries = [json.loads(line) for line in f if line.strip()]
+        self.time_scale = time_scale
+        self.position = 0
+        self.recorded_time = 0.0
+        self.started = time.time()
+
+    def wrap(self, name, factory):
+        """Returns replay proxy, the real object is not created."""
+        return ReplayProxy(self, name)
+
+    def peek(self):
+        if self.position >= len(self.entries):
+            raise ReplayMismatchError('Recording is over after %d calls' % self.position)
+        return self.entries[self.position]
+
+    def ref(self, value):
+        """Returns JSON form of call arguments as Recorder.ref does,
+        replay proxies are written as references.
+        """
+        if isinstance(value, ReplayProxy):
+            return {'Ref': value._name}
+        if isinstance(value, (list, tuple)):
+            return [self.ref(v) for v in value]
+        if isinstance(value, dict):
+            return dict((str(k), self.ref(v)) for k, v in value.items())
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        return repr(value)
+
+    def next(self, target, kind, attr, args=(), kwargs=None):
+        """Returns next recorded entry, checking it is the expected one:
+        the same target, attribute or method and call arguments.
+        """
+        entry = self.peek()
+        if entry['Target'] != target or entry.get(kind) != attr:
+            raise ReplayMismatchError('Call %d: expected %s.%s, recorded %s.%s' % (
+                self.position, target, attr, entry['Target'], entry.get('Call', entry.get('Attr'))))
+        if kind == 'Call':
+            # JSON round trip, as recorded values went through it
+            called = json.loads(json.dumps([self.ref(args), self.ref(kwargs or {})]))
+            if called != [entry['Args'], entry.get('Kwargs', {})]:
+                raise ReplayMismatchError('Call %d: %s.%s called with %s %s, recorded %s %s' % (
+                    self.position, target, attr, called[0], called[1], entry['Args'], entry.get('Kwargs', {})))
+        self.position += 1
+        self.recorded_time += entry['Elapsed']
+        if self.time_scale:
+            time.sleep(entry['Elapsed'] * self.time_scale)
+        if 'Error' in entry:
+            module, _, name = REPLAY_EXCEPTIONS.get(entry['Error'], 'builtins.RuntimeError').rpartition('.')
+            raise getattr(importlib.import_module(module), name)(entry['Message'])
+        return self.restore(entry['Result'])
+
+    def restore(self, value):
+        """Returns recorded value with references replaced by replay proxies."""
+        if isinstance(value, list):
+            return [self.restore(v) for v in value]
+        if isinstance(value, dict):
+            if list(value) == ['Ref']:
+                return ReplayProxy(self, value['Ref'])
+            return dict((k, self.restore(v)) for k, v in value.items())
+        return value
+
+    def report(self):
+        """Prints replay summary: recorded remote time against harness time."""
+        total = time.time() - self.started
+        print('Replayed %d of %d calls: %.1fs recorded remote time, %.1fs replay time' % (
+            self.position, len(self.entries), self.recorded_time, total))
+
+
+class ReplayProxy:
+    """ReplayProxy stands for a recorded object and serves its recorded
+    attributes and call results.
+    """
+
+    def __init__(self, player, name):
+        self._player = player
+        self._name = name
+
+    def __getattr__(self, attr):
+        player = self._player
+        if player.peek().get('Attr') == attr and player.peek()['Target'] == self._name:
+            return player.next(self._name, 'Attr', attr)
+
+        def call(*args, **kwargs):
+            return player.next(self._name, 'Call', attr, args, kwargs)
+
+        return call
+
+
+class PageSnapshot:
+    """PageSnapshot extracts facts about the current page in one execute_script
+    call returning compact JSON, instead of downloading driver.page_source:
+    which of the given texts the page contains (logged-in user, feature flags)
+    and rows of the VM table.
+    The result is cached until the page is left or its DOM changes, which is
+    tracked by a MutationObserver installed by the script.
+    """
+
+    VERSION_SCRIPT = "return window.__snapshot_version === undefined ? -1 : window.__snapshot_version;"
+
+    SCRIPT = """
+        if (window.__snapshot_version === undefined) {
+            window.__snapshot_version = 0;
+            new MutationObserver(function() { window.__snapshot_version++; }).observe(
+                document.documentElement, {childList: true, subtree: true, characterData: true});
+        }
+        var text = function(elem) { return elem ? elem.textContent.replace(/\\s+/g, ' ').trim() : null; };
+        var html = document.documentElement.outerHTML;
+        var found = {};
+        arguments[0].forEach(function(needle) { found[needle] = html.indexOf(needle) >= 0; });
+        var rows = [];
+        document.querySelectorAll('tr').forEach(function(tr) {
+            var checkbox = tr.querySelector(':scope > td > input');
+            var link = tr.querySelector(':scope > td > a');
+            if (!checkbox || !link) return;
+            var cells = tr.querySelectorAll(':scope > td');
+            rows.push({'Name': text(link), 'Href': link.href, 'Selected': checkbox.checked,
+                       'Status': text(tr.querySelector(':scope > td[class*="status"]')),
+                       'Public ip': cells.length > 3 ? text(cells[3]) : null});
+        });
+        return JSON.stringify({'Version': window.__snapshot_version, 'Url': location.href,
+                               'Found': found, 'Rows': rows});
+        """
+
+    def __init__(self, driver, needles=()):
+        self.driver = driver
+        self.needles = list(needles)
+        self.__data = None
+
+    def invalidate(self):
+        """Drops cached snapshot."""
+        self.__data = None
+
+    def get(self):
+        """Returns snapshot dict with 'Url', 'Found' and 'Rows'."""
+        if self.__data is not None and self.driver.execute_script(self.VERSION_SCRIPT) == self.__data['Version']:
+            return self.__data
+        self.__data = json.loads(self.driver.execute_script(self.SCRIPT, self.needles))
+        return self.__data
+
+    def contains(self, needle):
+        """Checks whether page source contains the text."""
+        if needle not in self.needles:
+            self.needles.append(needle)
+            self.invalidate()
+        return self.get()['Found'][needle]
+
+
+class EditPage:
+    """EditPage drives VM reconfigure page (/<id>/edit).
+    Page script estimates the price with get_vm_config() and ajax requests
+    on field changes; stop_estimation flag blocks submit while it is set.
+    EditPage waits for exactly these signals instead of fixed sleeps. All
+    fields are set in one script call with a single change event, instead
+    of keystroke by keystroke, so the estimation runs once per edit.
+    """
+
+    STATE_SCRIPT = """
+        if (window.__edit_requests === undefined) {
+            window.__edit_requests = 0;
+            if (window.jQuery) jQuery(document).ajaxSend(function() { window.__edit_requests++; });
+        }
+        var period = document.querySelector('div.period');
+        return {'Ready': document.readyState === 'complete' && typeof get_vm_config === 'function'
+                         && typeof stop_estimation !== 'undefined' && !stop_estimation
+                         && (!period || document.body.textContent.indexOf('per month') >= 0),
+                'Pending': window.jQuery ? jQuery.active : 0,
+                'Requests': window.__edit_requests};
+        """
+
+    EDIT_SCRIPT = """
+        var values = arguments[0], old = {}, last = null;
+        Object.keys(values).forEach(function(selector) {
+            var elem = document.querySelector(selector);
+            old[selector] = elem.value.trim();
+            if (elem.value !== values[selector]) {
+                elem.value = values[selector];
+                last = elem;
+            }
+        });
+        // Estimation reads all fields through get_vm_config()
+        if (last) last.dispatchEvent(new Event('change', {bubbles: true}));
+        return {'Old': old, 'Changed': last !== null};
+        """
+
+    def __init__(self, driver, start_polls=4, quiet_polls=2):
+        self.driver = driver
+        self.start_polls = start_polls
+        self.quiet_polls = quiet_polls
+
+    def state(self):
+        """Returns dict with 'Ready', 'Pending' ajax requests and number of 'Requests' sent."""
+        return self.driver.execute_script(self.STATE_SCRIPT)
+
+    def wait_ready(self, timeout=UI_TIMEOUT):
+        """Waits until page script is initialized and no estimation is pending."""
+        webdriver_wait(self.driver, timeout).until(lambda d: self.__idle(self.state()))
+
+    @staticmethod
+    def __idle(state):
+        return state['Ready'] and state['Pending'] == 0
+
+    def edit(self, values, timeout=UI_TIMEOUT):
+        """Sets fields given as dict of CSS selector -> value and waits for
+        the estimation they trigger. Returns dict of selector -> old value.
+        Estimation request is expected within start_polls state polls, and
+        the page must stay idle with no new request for quiet_polls polls
+        in a row, so a submit does not race a follow-up estimation. Polls are
+        counted, not timed, so replay polls as often as the recording.
+        """
+        requests = self.state()['Requests']
+        result = self.driver.execute_script(self.EDIT_SCRIPT, values)
+        if result['Changed']:
+            polls = {'All': 0, 'Quiet': 0, 'Requests': requests}
+
+            def estimated(driver):
+                state = self.state()
+                polls['All'] += 1
+                if self.__idle(state) and state['Requests'] == polls['Requests']:
+                    polls['Quiet'] += 1
+                else:
+                    polls['Quiet'] = 0
+                polls['Requests'] = state['Requests']
+                return polls['Quiet'] >= self.quiet_polls \
+                    and (state['Requests'] > requests or polls['All'] > self.start_polls)
+
+            webdriver_wait(self.driver, timeout).until(estimated)
+        return result['Old']
+
+
+class VMRecord:
+    """VMRecord is one row of the data center VM table:
+    name, id, status, public ip, detail page URL and checkbox handle.
+    """
+
+    def __init__(self, driver, row):
+        self.driver = driver
+        self.__checkbox = None
+        self.update(row)
+
+    def update(self, row):
+        """Updates record from snapshot row."""
+        self.name = row['Name']
+        self.href = row['Href']
+        self.vm_id = self.href[self.href.rfind('/') + 1:]
+        self.status = row['Status'] or ''
+        self.public_ip = row['Public ip'] or ''
+        self.selected = row['Selected']
+
+    def checkbox(self):
+        """Returns checkbox element of the row, looked up once by the VM id
+        (link ends with '/<id>'), as names may be shared by several rows.
+        """
+        if self.__checkbox is None:
+            self.__checkbox = self.driver.find_element_by_xpath(
+                "//tr[td/a[substring(@href, string-length(@href) - %d) = '/%s']]/td/input"
+                % (len(self.vm_id), self.vm_id))
+        return self.__checkbox
+
+    def select(self):
+        """Selects the row, if not selected yet."""
+        def click():
             try:
-                ssh_client = SSHClient(address, username, password)
-                count = retries
-            except NoValidConnectionsError:
-                count += 1
-                time.sleep(timeout)
+                elem = self.checkbox()
+                if not elem.is_selected():
+                    elem.click()
+            except exceptions.StaleElementReferenceException:
+                # Table was redrawn, look the checkbox up again
+                self.__checkbox = None
+                raise
+
+        RETRY.call('ui', click)
+
+    def deselect(self):
+        """Clears selection of the row, if selected."""
+        if self.selected:
+            def click():
+                try:
+                    elem = self.checkbox()
+                    if elem.is_selected():
+                        elem.click()
+                except exceptions.StaleElementReferenceException:
+                    # Table was redrawn, look the checkbox up again
+                    self.__checkbox = None
+                    raise
+
+            RETRY.call('ui', click)
 
-        return ssh_client
+
+class VMInventory:
+    """VMInventory is a model of the data center VM table.
+    The table is parsed from a page snapshot once per change and kept as
+    records indexed by exact name and by VM id. Records of rows, which did
+    not change, are kept together with their checkbox handles.
+    Names shared by several rows (e.g. a VM of this run and an orphan of
+    a crashed one) are ambiguous: looking them up raises DuplicateVMNameError.
+    """
+
+    def __init__(self, driver, page):
+        self.driver = driver
+        self.page = page
+        self.__rows = None
+        self.__by_name = {}
+        self.__by_id = {}
+        self.__duplicates = set()
+
+    def refresh(self):
+        """Updates records from the current page snapshot."""
+        rows = self.page.get()['Rows']
+        if rows is self.__rows:
+            return
+        self.__rows = rows
+        by_id = {}
+        for row in rows:
+            record = self.__by_id.get(row['Href'][row['Href'].rfind('/') + 1:])
+            if record is not None and record.href == row['Href']:
+                record.update(row)
+            else:
+                record = VMRecord(self.driver, row)
+            by_id[record.vm_id] = record
+        names = collections.Counter(record.name for record in by_id.values())
+        self.__by_id = by_id
+        self.__by_name = dict((record.name, record) for record in by_id.values() if names[record.name] == 1)
+        self.__duplicates = set(name for name, count in names.items() if count > 1)
+
+    def __check(self, name):
+        if name in self.__duplicates:
+            raise DuplicateVMNameError('%s matches several VMs' % name)
+
+    def __getitem__(self, name):
+        self.refresh()
+        self.__check(name)
+        return self.__by_name[name]
+
+    def __contains__(self, name):
+        self.refresh()
+        return name in self.__by_name or name in self.__duplicates
+
+    def get(self, name):
+        """Returns record by VM name or None."""
+        self.refresh()
+        self.__check(name)
+        return self.__by_name.get(name)
+
+    def duplicates(self):
+        """Returns names shared by several VMs."""
+        self.refresh()
+        return set(self.__duplicates)
+
+    def by_id(self, vm_id):
+        """Returns record by VM id or None."""
+        self.refresh()
+        return self.__by_id.get(vm_id)
+
+    def names(self):
+        """Returns names of all VMs in the table."""
+        self.refresh()
+        return list(self.__by_name) + sorted(self.__duplicates)
+
+    def records(self):
+        """Returns records of all VMs in the table, including shared names."""
+        self.refresh()
+        return list(self.__by_id.values())
+
+
+class LifecycleCancelled(Exception):
+    """Raised in ensure_state, when the request was cancelled."""
+    pass
+
+
+class VMLifecycle:
+    """VMLifecycle is a state machine of VM power state on data center page.
+    ensure_state picks the transition needed to bring VM to the state,
+    performs it and waits for the status. Statuses of all VMs are polled
+    once per poll interval and shared by all waiting requests, so many
+    requests may wait concurrently (e.g. from several threads).
+    Page actions and polls are serialized, as WebDriver is not thread-safe.
+    Latency of every transition is recorded in metrics.
+    """
+
+    # (current state, target state) -> Power menu item
+    TRANSITIONS = {
+        ('off', 'on'): 'Power on',
+        ('on', 'off'): 'Power off',
+    }
+
+    def __init__(self, driver, vms, poll_interval=2):
+        self.driver = driver
+        self.vms = vms
+        self.poll_interval = poll_interval
+        self.metrics = []
+        self.__changed = threading.Condition(threading.RLock())
+        self.__polled = 0
+        self.__cancelled = set()
+        self.__waiting = collections.Counter()
+
+    @staticmethod
+    def state_of(status):
+        """Returns 'on' or 'off' for stable status, None while VM is in transition."""
+        words = status.lower().split()
+        if 'off' in words:
+            return 'off'
+        if 'on' in words:
+            return 'on'
+        return None
+
+    def state(self, name):
+        """Returns current state of VM, None if in transition or not listed."""
+        with self.__changed:
+            record = self.vms.get(name)
+            return self.state_of(record.status) if record is not None else None
+
+    def __poll(self):
+        """Refreshes VM table, if poll interval is over, and wakes up waiters."""
+        if time.time() - self.__polled >= self.poll_interval * TIME_SCALE:
+            self.vms.refresh()
+            self.__polled = time.time()
+            self.__changed.notify_all()
+
+    def __transition(self, name, action):
+        """Selects the VM only and runs Power menu action."""
+        driver = self.driver
+        target = self.vms[name]
+        for record in self.vms.records():
+            if record is not target and record.selected:
+                record.deselect()
+        target.select()
+        driver.find_element_by_xpath("//a[contains(text(), 'Power')]").click()
+        driver.find_element_by_xpath("//a[contains(text(), '%s')]" % action).click()
+        if action == 'Power off':
+            webdriver_wait(driver, UI_TIMEOUT).until(
+                EC.element_to_be_clickable((by.By.XPATH, "//button[contains(@value, 'yes')]")))
+            driver.find_element_by_xpath("//button[contains(@value, 'yes')]").click()
+        self.vms.page.invalidate()
+
+    def ensure_state(self, name, state, deadline=VM_TIMEOUT):
+        """Brings VM to state ('on' or 'off') within deadline seconds.
+        Waits while VM is in transition (e.g. being created or rebuilt),
+        then runs the transition, if needed, and waits for its result.
+        """
+        started = time.time()
+        transition = None
+        with self.__changed:
+            self.__cancelled.discard(name)
+            self.__waiting[name] += 1
+            try:
+                while True:
+                    if name in self.__cancelled:
+                        raise LifecycleCancelled(name)
+                    current = self.state(name)
+                    PROGRESS.vm_state(name, current or 'transition', state if current != state else None)
+                    if current == state:
+                        break
+                    if current is not None and transition is None:
+                        transition = (current, state, time.time())
+                        self.__transition(name, self.TRANSITIONS[(current, state)])
+                    remaining = started + deadline - time.time()
+                    if remaining <= 0:
+                        raise exceptions.TimeoutException('VM %s is not %s after %ss' % (name, state, deadline))
+                    self.__changed.wait(min(self.poll_interval * TIME_SCALE, remaining))
+                    self.__poll()
+            finally:
+                self.__waiting[name] -= 1
+
+            if transition is not None:
+                self.metrics.append({'VM Name': name, 'From': transition[0], 'To': state,
+                                     'Latency': time.time() - transition[2]})
+                PROGRESS.vm_transition(name, transition[0], state, self.metrics[-1]['Latency'])
+        return time.time() - started
+
+    def ensure_states(self, states, deadline=VM_TIMEOUT):
+        """Runs ensure_state for several VMs concurrently.
+        states is dict of VM name -> state. Returns dict of VM name -> seconds.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(states) or 1) as pool:
+            futures = dict((name, pool.submit(self.ensure_state, name, state, deadline))
+                           for name, state in states.items())
+            return dict((name, future.result()) for name, future in futures.items())
+
+    def cancel(self, name=None):
+        """Cancels pending ensure_state requests of the VM, or of all VMs."""
+        with self.__changed:
+            waiting = [n for n, count in self.__waiting.items() if count > 0]
+            self.__cancelled.update([name] if name is not None else waiting)
+            self.__changed.notify_all()
 
 
 class TestGroup:
@@ -103,20 +2147,50 @@ class TestGroup:
     Tests are mutually connected with each other and share common resources (e.g. config fields)
     """
 
-    def __init__(self, email, password, httpaddress):
+    def __init__(self, email, password, httpaddress, ledger=None, session=None, keystore=None):
         self.email = email
         self.password = password
         self.httpaddress = httpaddress
 
+        # Data center page address, remembered in set_up
+        self.datacenter_url = None
+
+        # Every created VM is recorded in the ledger, so it can be destroyed
+        # in bulk after the run or by the orphan sweep after a crash
+        self.ledger = ledger or RunLedger()
+
+        # VM passwords and host keys, rotated when VMs are destroyed
+        self.keystore = keystore or KEYSTORE
+
         # The config dicts are used to store VM parameters:
         # RAM, vCPU number, OS, IP Adresses, Software settings and VM id.
         # These parameters are shared among the tests
         self.ubuntu_config = {}
         self.centos_config = {}
 
+        # In-VM benchmark results by VM spec (OS, vCPU, RAM, storage tier)
+        self.benchmark_results = {}
+
         # Set up Firefox
-        firefoxprofile = webdriver.FirefoxProfile('default-firefox-profile/default')
-        self.driver = webdriver.Firefox(firefox_profile=firefoxprofile)
+        def firefox():
+            firefoxprofile = webdriver.FirefoxProfile('default-firefox-profile/default')
+            return webdriver.Firefox(firefox_profile=firefoxprofile)
+
+        # Session is a Recorder or Player: WebDriver and VM operations
+        # are recorded, or replayed without browser and network
+        self.session = session
+        if session is None:
+            self.driver = firefox()
+            self.remote = Remote(self.keystore)
+        else:
+            self.driver = session.wrap('driver', firefox)
+            self.remote = session.wrap('remote', lambda: Remote(self.keystore))
+
+        # Page facts are checked through snapshots instead of page source
+        self.page = PageSnapshot(self.driver, [email, 'Profile', 'My Account', 'Select firewall templates'])
+        self.vms = VMInventory(self.driver, self.page)
+        self.lifecycle = VMLifecycle(self.driver, self.vms)
+        self.admission = AdmissionController(self.driver, email)
 
         # In QA, create instance page does not have 'create' button.
         # Run button callback instead.
@@ -185,14 +2259,13 @@ class TestGroup:
     @staticmethod
     def sleep(seconds=2):
         """Simple sleep function with default value of 2 seconds."""
-        time.sleep(seconds)
+        time.sleep(seconds * TIME_SCALE)
 
     @property
     def is_authorized(self):
-        """Checks whether the user is authorized by scanning the page source for email or keywords."""
-        return (self.email in self.driver.page_source) \
-               or ('Profile' in self.driver.page_source) \
-               or ('My Account' in self.driver.page_source)
+        """Checks whether the user is authorized by scanning the page snapshot for email or keywords."""
+        found = self.page.get()['Found']
+        return found[self.email] or found['Profile'] or found['My Account']
 
     def login(self):
         """Carries out authorization procedure in both production and QA."""
@@ -207,21 +2280,21 @@ class TestGroup:
         try:
             driver.find_element_by_xpath("//*[contains(text(), 'Latvija')]").click()
             driver.find_element_by_xpath("//*[contains(text(), 'Krievija')]").click()
-        except (NoSuchElementException, ElementNotVisibleException):
+        except (exceptions.NoSuchElementException, exceptions.ElementNotVisibleException):
             pass
 
         # If attempted to log in before, switch country. Pass if already switched
         try:
             driver.find_element_by_xpath("//*[contains(text(), 'Latvia')]").click()
             driver.find_element_by_xpath("//*[contains(text(), 'Russia')]").click()
-        except (NoSuchElementException, ElementNotVisibleException):
+        except (exceptions.NoSuchElementException, exceptions.ElementNotVisibleException):
             pass
 
         # Switch from RU to EN, if not switched before. Pass if already switched
         try:
             driver.find_element_by_xpath("//*[contains(text(), 'RU')]").click()
             driver.find_element_by_xpath("//*[contains(text(), 'EN')]").click()
-        except (NoSuchElementException, ElementNotVisibleException):
+        except (exceptions.NoSuchElementException, exceptions.ElementNotVisibleException):
             pass
 
         # Go to login page and authorize
@@ -230,7 +2303,7 @@ class TestGroup:
         self.sleep()
         driver.find_element_by_xpath("//input[contains(@id, 'email')]").send_keys('%s' % self.email)
         driver.find_element_by_xpath("//input[contains(@id, 'password')]").send_keys('%s' % self.password)
-        driver.find_element_by_xpath("//input[contains(@id, 'password')]").send_keys(Keys.ENTER)
+        driver.find_element_by_xpath("//input[contains(@id, 'password')]").send_keys(keys.Keys.ENTER)
 
         # Go to catalog
         self.sleep(3)
@@ -239,7 +2312,7 @@ class TestGroup:
         # If in QA, go to cloud services
         try:
             driver.find_element_by_link_text('Cloud Services').click()
-        except NoSuchElementException:
+        except exceptions.NoSuchElementException:
             pass
 
         # Go to virtual machines
@@ -253,41 +2326,130 @@ class TestGroup:
         if self.is_authorized:
             try:
                 self.driver.find_element_by_xpath("//a[contains(text(), 'Logout')]").click()
-            except NoSuchElementException:
+            except exceptions.NoSuchElementException:
                 pass
 
             self.sleep()
             try:
                 self.driver.find_element_by_id('top-nav-logout-link').click()
-            except NoSuchElementException:
+            except exceptions.NoSuchElementException:
                 pass
 
+    def delete_vms(self, names=(), pattern=None, run_tag=None, ids=(), timeout=VM_TIMEOUT):
+        """Destroys VMs in one bulk action if on data center page.
+        VMs are selected by exact names, by shell-style name pattern,
+        by run tag from the ledger or by VM ids. Waits until all of them
+        are gone and returns list of destroyed VM names.
+        """
+        driver = self.driver
+        existing = self.vms.names()
+        ids = set(ids)
+        names = set(names)
+        if pattern is not None:
+            names.update(fnmatch.filter(existing, pattern))
+        if run_tag is not None:
+            for e in self.ledger.entries(run_tag):
+                if e.get('VM id'):
+                    ids.add(e['VM id'])
+                else:
+                    names.add(e['VM Name'])
+        # Destroying by ambiguous name could hit a VM of another run
+        ambiguous = sorted(names & self.vms.duplicates())
+        if ambiguous:
+            print('Not destroying VMs with duplicate names: %s' % ', '.join(ambiguous))
+        records = [self.vms.by_id(vm_id) for vm_id in ids] + \
+            [self.vms.get(name) for name in names if name in existing and name not in ambiguous]
+        records = dict((record.vm_id, record) for record in records if record is not None)
+        if not records:
+            return []
+        targets = sorted(record.name for record in records.values())
+
+        print('Destroying VMs: %s...' % ', '.join(targets))
+        addresses = [record.public_ip for record in records.values() if record.public_ip]
+        for record in records.values():
+            record.select()
+        driver.find_element_by_xpath("//a[contains(text(), 'Destroy')]").click()
+        webdriver_wait(driver, UI_TIMEOUT).until(
+            EC.visibility_of_element_located(
+                (by.By.XPATH, "//form[contains(text(), 'You are going to destroy')]/input")
+            )
+        )
+        driver.find_element_by_xpath("//form[contains(text(), 'You are going to destroy')]/input"). \
+            send_keys('DESTROY', keys.Keys.TAB, keys.Keys.TAB, keys.Keys.ENTER)
+
+        # Single status poll for all destroyed VMs
+        webdriver_wait(driver, timeout).until(lambda d: all(self.vms.by_id(vm_id) is None for vm_id in records))
+        for name in targets:
+            PROGRESS.vm_removed(name)
+        self.keystore.forget(targets, addresses)
+        self.admission.release(*targets)
+        print('\t...destroyed\n')
+        return targets
+
     def delete_vm(self, vm_name):
         """Deletes vm with given name if on data center page"""
-        driver = self.driver
-        if vm_name in driver.page_source:
-            print('VM %s will be deleted in 10 seconds')
-            self.sleep(10)
-            driver.find_element_by_xpath("//a[contains(text(), '%s')]/../../td/input" % vm_name).click()
-            driver.find_element_by_xpath("//a[contains(text(), 'Destroy')]").click()
-            self.sleep()
-            driver.find_element_by_xpath("//form[contains(text(), 'You are going to destroy')]/input"). \
-                send_keys('DESTROY', Keys.TAB, Keys.TAB, Keys.ENTER)
+        deleted = self.delete_vms(names=[vm_name])
+        self.ledger.remove(deleted, run_tags=[self.ledger.run_tag])
+        return deleted
+
+    def cleanup(self, pattern=None):
+        """Destroys VMs created by this run, or matching the pattern if given."""
+        if self.datacenter_url is not None and self.driver.current_url != self.datacenter_url:
+            self.driver.get(self.datacenter_url)
+        if pattern is None:
+            deleted = self.delete_vms(run_tag=self.ledger.run_tag)
+        else:
+            deleted = self.delete_vms(pattern=pattern)
+        self.ledger.remove(deleted, run_tags=[self.ledger.run_tag])
+        return deleted
+
+    def sweep_orphans(self, max_age=6 * 3600):
+        """Destroys VMs left by crashed runs according to the ledger.
+        VMs are found by id: a name alone may belong to a VM of another runner.
+        """
+        orphans = self.ledger.orphans(max_age)
+        if not orphans:
+            return []
+        unknown = sorted(e['VM Name'] for e in orphans if not e.get('VM id'))
+        if unknown:
+            print('Not destroying orphans of unknown VM id, check them by hand: %s' % ', '.join(unknown))
+        deleted = self.delete_vms(ids=[e['VM id'] for e in orphans if e.get('VM id')])
+        # Orphans already gone from the data center are forgotten as well
+        self.ledger.discard([e for e in orphans if not e.get('VM id') or self.vms.by_id(e['VM id']) is None])
+        return deleted
+
+    def sweep_before_run(self, max_age=6 * 3600):
+        """Destroys orphans of crashed runs before the first test, so their
+        VM names are free and cannot be confused with VMs of this run.
+        Logs in only if the ledger contains orphans. Failures are reported,
+        but do not stop the run.
+        """
+        if self.session is not None or not self.ledger.orphans(max_age):
+            return []
+        try:
+            self.set_up()
+            return self.sweep_orphans(max_age)
+        except Exception as e:
+            print('Orphan sweep failed: %s' % e)
+            return []
 
     def configure_vm(self, config):
         """Sets up virtual machine configuration according to given config."""
         print('Configuring VM...')
         driver = self.driver
 
+        # Within the account quota: fails fast before the form is filled
+        self.admission.admit(config['VM Name'], vm_demand(config))
+
         # VM Name
         elem = driver.find_element_by_xpath("//input[contains(@id, 'name')]")
-        elem.send_keys(Keys.CONTROL + 'a')
-        elem.send_keys(Keys.DELETE)
+        elem.send_keys(keys.Keys.CONTROL + 'a')
+        elem.send_keys(keys.Keys.DELETE)
         elem.send_keys('%s' % config['VM Name'])
         print('\tVM Name: %s' % config['VM Name'])
 
         # OS
-        Select(driver.find_element_by_id('os')).select_by_visible_text('%s' % config['OS'])
+        ui.Select(driver.find_element_by_id('os')).select_by_visible_text('%s' % config['OS'])
         print('\tOS: %s' % config['OS'])
 
         # Software
@@ -320,54 +2482,66 @@ class TestGroup:
         # vCPU
         if 'vCPU' in config:
             elem = driver.find_element_by_id('f_input_vcpus')
-            elem.send_keys(Keys.CONTROL + 'a')
-            elem.send_keys(Keys.DELETE)
+            elem.send_keys(keys.Keys.CONTROL + 'a')
+            elem.send_keys(keys.Keys.DELETE)
             elem.send_keys('%s' % config['vCPU'])
             print('\tvCPU: %s' % config['vCPU'])
 
         # RAM
         if 'RAM' in config:
             elem = driver.find_element_by_id('f_input_memory')
-            elem.send_keys(Keys.CONTROL + 'a')
-            elem.send_keys(Keys.DELETE)
+            elem.send_keys(keys.Keys.CONTROL + 'a')
+            elem.send_keys(keys.Keys.DELETE)
             elem.send_keys('%s' % config['RAM'])
             print('\tRAM: %s' % config['RAM'])
 
         # HDD
         if 'HDD 1 Type' in config:
-            Select(driver.find_element_by_id('hdd_type_1')).select_by_visible_text('%s' % config['HDD 1 Type'])
+            ui.Select(driver.find_element_by_id('hdd_type_1')).select_by_visible_text('%s' % config['HDD 1 Type'])
             print('\tHDD 1 Type: %s' % config['HDD 1 Type'])
         if 'HDD 1 Size' in config:
             elem = driver.find_element_by_id('f_input_hdd_1_size')
-            elem.send_keys(Keys.CONTROL + 'a')
-            elem.send_keys(Keys.DELETE)
+            elem.send_keys(keys.Keys.CONTROL + 'a')
+            elem.send_keys(keys.Keys.DELETE)
             elem.send_keys('%s' % config['HDD 1 Size'])
             print('\tHDD 1 Size: %s' % config['HDD 1 Size'])
 
         # Bandwidth
         if 'Bandwidth' in config:
             elem = driver.find_element_by_id('f_input_bandwidth')
-            elem.send_keys(Keys.CONTROL + 'a')
-            elem.send_keys(Keys.DELETE)
+            elem.send_keys(keys.Keys.CONTROL + 'a')
+            elem.send_keys(keys.Keys.DELETE)
             elem.send_keys('%s' % config['Bandwidth'])
             print('\tBandwidth: %s' % config['Bandwidth'])
 
         # Hostname
         if 'Hostname' in config:
             elem = driver.find_element_by_xpath("//input[contains(@name, 'hostname')]")
-            elem.send_keys(Keys.CONTROL + 'a')
-            elem.send_keys(Keys.DELETE)
+            elem.send_keys(keys.Keys.CONTROL + 'a')
+            elem.send_keys(keys.Keys.DELETE)
             elem.send_keys('%s' % config['Hostname'])
             print('\tHostname: %s' % config['Hostname'])
 
         # Password
         if 'Password' in config:
             elem = driver.find_element_by_xpath("//input[contains(@name, 'password')]")
-            elem.send_keys(Keys.CONTROL + 'a')
-            elem.send_keys(Keys.DELETE)
+            elem.send_keys(keys.Keys.CONTROL + 'a')
+            elem.send_keys(keys.Keys.DELETE)
             elem.send_keys('%s' % config['Password'])
             print('\tPassword: %s' % config['Password'])
 
+        # Runner SSH key, if the form takes one: later connections skip password exchange
+        key_pushed = False
+        try:
+            elem = driver.find_element_by_xpath("//*[self::input or self::textarea][contains(@name, 'ssh_key')]")
+            elem.send_keys(keys.Keys.CONTROL + 'a')
+            elem.send_keys(keys.Keys.DELETE)
+            elem.send_keys(self.remote.public_key())
+            key_pushed = True
+            print('\tSSH key: runner key')
+        except exceptions.NoSuchElementException:
+            pass
+
         # Allow internet (public ipv4)
         if 'Allow public ipv4' in config:
             # elem = driver.find_element_by_xpath("//label[contains(text(), 'Public IPv4')]/input") # Bad selector
@@ -386,7 +2560,7 @@ class TestGroup:
             driver.find_element_by_xpath("//a[contains(text(), 'Firewall rules')]").click()
             self.sleep()
 
-            if 'Select firewall templates' in driver.page_source:
+            if self.page.contains('Select firewall templates'):
                 # In QA
                 driver.find_element_by_xpath("//button[contains(@title, 'Select firewall templates')]").click()
                 self.sleep()
@@ -401,7 +2575,7 @@ class TestGroup:
                             if elem.is_selected():
                                 elem.click()
                             print('\t%s disabled' % rule[0])
-                    except NoSuchElementException:
+                    except exceptions.NoSuchElementException:
                         print('\t%s not found' % rule[0])
 
                 driver.find_element_by_xpath(
@@ -421,18 +2595,22 @@ class TestGroup:
                             if elem.is_selected():
                                 elem.click()
                             print('\t%s disabled' % rule[0])
-                    except NoSuchElementException:
+                    except exceptions.NoSuchElementException:
                         print('\t%s not found' % rule[0])
 
             driver.find_element_by_xpath("//a[contains(text(), 'Instance')]").click()
 
-        # Press submit button
+        # Submit
         try:
             driver.find_element_by_xpath("//button[contains(@id, 'createButton')]").click()
-        except NoSuchElementException:
+        except exceptions.NoSuchElementException:
             # Call script to emulate button click
             self.sleep()
             driver.execute_script(self.create_script)
+        PROGRESS.vm_state(config['VM Name'], 'creating', 'on')
+        self.ledger.add(config['VM Name'])
+        if 'Password' in config:
+            self.keystore.add_credentials(config['VM Name'], 'root', config['Password'], key_pushed)
 
         print('\t...configured\n')
 
@@ -447,12 +2625,43 @@ class TestGroup:
             self.driver.find_element_by_xpath("//input[contains(@value, 'Order now')]").click()
 
             # Close default machine create popup
-            WebDriverWait(self.driver, 40).until(
+            webdriver_wait(self.driver, 40).until(
                 EC.visibility_of_element_located(
-                    (By.XPATH, "//button[contains(@class, 'btn btn-primary cart-clear')]")
+                    (by.By.XPATH, "//button[contains(@class, 'btn btn-primary cart-clear')]")
                 )
             )
             self.driver.find_element_by_xpath("//button[contains(@class, 'btn btn-primary cart-clear')]").click()
+            self.datacenter_url = self.driver.current_url
+
+    def reconfigure_vm(self, config, vcpus, ram):
+        """Sets vCPU and RAM of stopped VM on its edit page and waits for rebuild."""
+        driver = self.driver
+        url = driver.current_url
+        driver.get(url[:len(url) - 1] + '/' + config['VM id'] + '/edit')
+
+        page = EditPage(driver)
+        page.wait_ready()
+        old = page.edit({'#f_input_vcpus': vcpus, 'input[id*="f_input_memory"]': ram})
+        print('\tvCPU: %s -> %s' % (old['#f_input_vcpus'], vcpus))
+        print('\tRAM: %s -> %s' % (old['input[id*="f_input_memory"]'], ram))
+
+        # Only growth needs quota
+        growth = config['VM Name'] + ' reconfigure'
+        self.admission.admit(growth, {'vCPU': float(vcpus) - float(old['#f_input_vcpus'] or 0),
+                                      'RAM': float(ram) - float(old['input[id*="f_input_memory"]'] or 0)},
+                             vm_name=config['VM Name'])
+        try:
+            driver.find_element_by_xpath("//button[contains(@id, 'createButton')]").click()
+        except exceptions.NoSuchElementException:
+            # Call script to emulate button click
+            driver.execute_script(self.reconfigure_script)
+
+        # Wait for machine to rebuild
+        driver.back()
+        self.sleep()
+        driver.refresh()
+        self.lifecycle.ensure_state(config['VM Name'], 'off')
+        self.admission.created(growth)
 
     def test_008(self):
         """Test number 8.
@@ -500,58 +2709,30 @@ class TestGroup:
         driver.refresh()
 
         # Wait for machine to create (5 mins)
-        WebDriverWait(driver, 300).until(
-            EC.text_to_be_present_in_element(
-                (By.XPATH,
-                 "//a[contains(text(), '%s')]/../../td[contains(@class, 'status')]" % self.ubuntu_config['VM Name']),
-                'off'
-            )
-        )
+        self.lifecycle.ensure_state(self.ubuntu_config['VM Name'], 'off')
+        self.admission.created(self.ubuntu_config['VM Name'])
         print('\t...created\n')
 
         # Get and remember VM id (it is used to get reconfigure page in the latter tests)
-        href = driver.find_element_by_xpath(
-            "//a[contains(text(), '%s')]" % self.ubuntu_config['VM Name']).get_attribute(
-            'href')
-        vm_id = href[href.rfind('/') + 1:]
-        self.ubuntu_config['VM id'] = vm_id
+        self.ubuntu_config['VM id'] = self.vms[self.ubuntu_config['VM Name']].vm_id
+        self.ledger.identify(self.ubuntu_config['VM Name'], self.ubuntu_config['VM id'])
 
-        # Start VM
+        # Start VM (5 mins)
         print("Starting VM %s..." % self.ubuntu_config['VM Name'])
-        elem = driver.find_element_by_xpath(
-            "//a[contains(text(), '%s')]/../../td/input" % self.ubuntu_config['VM Name'])
-        if not elem.is_selected():
-            elem.click()
-        driver.find_element_by_xpath("//a[contains(text(), 'Power')]").click()
-        driver.find_element_by_xpath("//a[contains(text(), 'Power on')]").click()
-
-        # Wait for machine to start (5 mins)
-        WebDriverWait(driver, 300).until(
-            EC.text_to_be_present_in_element(
-                (By.XPATH,
-                 "//a[contains(text(), '%s')]/../../td[contains(@class, 'status')]" % self.ubuntu_config['VM Name']),
-                'on'
-            )
-        )
+        self.lifecycle.ensure_state(self.ubuntu_config['VM Name'], 'on')
         print('\t...started\n')
 
         # Ping public ip
         self.sleep(5)
-        self.ubuntu_config['Public ip'] = driver.find_element_by_xpath(
-            "//a[contains(text(), '%s')]/../../td[4]" % self.ubuntu_config['VM Name']).text.strip()
+        self.ubuntu_config['Public ip'] = self.vms[self.ubuntu_config['VM Name']].public_ip
+        self.keystore.bind(self.ubuntu_config['Public ip'], self.ubuntu_config['VM Name'])
         print('Pinging public ip: ' + self.ubuntu_config['Public ip'])
-        status = ping(self.ubuntu_config['Public ip'])
-        try:
-            assert 0 == status
-        except AssertionError:
-            # Wait a bit longer if not available in first time and retry
-            self.sleep(10)
-            status = ping(self.ubuntu_config['Public ip'])
-            assert 0 == status
+        status = self.remote.ping(self.ubuntu_config['Public ip'])
+        assert 0 == status
         print('\t...pinging public ip OK\n')
 
         # Obtain private ip and gateway
-        driver.find_element_by_xpath("//a[contains(text(), '%s')]" % self.ubuntu_config['VM Name']).click()
+        driver.get(self.vms[self.ubuntu_config['VM Name']].href)
         self.sleep()
         self.ubuntu_config['Private ip'] = driver.find_element_by_xpath(
             "//td[contains(text(), 'Private IP')]/../td[2]").text.strip()
@@ -563,15 +2744,27 @@ class TestGroup:
 
         # Start vm-side testing
         print('Starting vm-side testing...\n')
-        ssh_client = SSHClient.get_ssh_client(self.ubuntu_config['Public ip'], 'root',
+        ssh_client = self.remote.get_ssh_client(self.ubuntu_config['Public ip'], 'root',
                                               self.ubuntu_config['Password'])
 
         if ssh_client is None:
-            print('\t...SSH connection refused after 5 retries')
+            print('\t...SSH connection refused')
         else:
+            # Independent checks run concurrently over one connection
+            results = ssh_client.run_parallel([
+                'ifconfig',
+                'ping -c 4 %s' % self.ubuntu_config['Gateway'],
+                'apt list --installed | grep apache2',
+                'apt list --installed | grep mysql-server',
+                'apt list --installed | grep php5-common',
+                'cat /proc/cpuinfo | grep processor',
+                'cat /proc/meminfo | grep MemTotal',
+                'parted -l | grep Disk',
+            ])
+
             # Check private ip
             print('Running: ifconfig:')
-            data = ssh_client.send_command('ifconfig')[0]
+            data = results['ifconfig'][0]
             for line in data.splitlines():
                 print('\t%s' % line)
             assert self.ubuntu_config['Private ip'] in data
@@ -579,7 +2772,7 @@ class TestGroup:
 
             # Ping gateway
             print('Running: ping -c 4 %s' % self.ubuntu_config['Gateway'])
-            data, status = ssh_client.send_command('ping -c 4 %s' % self.ubuntu_config['Gateway'])
+            data, status = results['ping -c 4 %s' % self.ubuntu_config['Gateway']]
             for line in data.splitlines():
                 print('\t%s' % line)
             assert 0 == status
@@ -587,7 +2780,7 @@ class TestGroup:
 
             # Check apache
             print('Running: apt list --installed | grep apache2')
-            data = ssh_client.send_command('apt list --installed | grep apache2')[0]
+            data = results['apt list --installed | grep apache2'][0]
             for line in data.splitlines():
                 print('\t%s' % line)
             assert 'apache2' in data
@@ -595,7 +2788,7 @@ class TestGroup:
 
             # Check mysql
             print('Running: apt list --installed | grep mysql-server')
-            data = ssh_client.send_command('apt list --installed | grep mysql-server')[0]
+            data = results['apt list --installed | grep mysql-server'][0]
             for line in data.splitlines():
                 print('\t%s' % line)
             assert 'mysql-server' in data
@@ -603,7 +2796,7 @@ class TestGroup:
 
             # Check php
             print('Running: apt list --installed | grep php5-common')
-            data = ssh_client.send_command('apt list --installed | grep php5-common')[0]
+            data = results['apt list --installed | grep php5-common'][0]
             for line in data.splitlines():
                 print('\t%s' % line)
             assert 'php5-common' in data
@@ -611,7 +2804,7 @@ class TestGroup:
 
             # Check processor
             print('Running: cat /proc/cpuinfo | grep processor')
-            data = ssh_client.send_command('cat /proc/cpuinfo | grep processor')[0]
+            data = results['cat /proc/cpuinfo | grep processor'][0]
             for line in data.splitlines():
                 print('\t%s' % line)
             assert '7' in data  # Number of processors starts with 0
@@ -620,7 +2813,7 @@ class TestGroup:
 
             # Check RAM
             print('\nRunning: cat /proc/meminfo | grep MemTotal')
-            data = ssh_client.send_command('cat /proc/meminfo | grep MemTotal')[0]
+            data = results['cat /proc/meminfo | grep MemTotal'][0]
             for line in data.splitlines():
                 print('\t%s' % line)
             assert '16433320' in data
@@ -628,7 +2821,7 @@ class TestGroup:
 
             # Check disk
             print('Running: parted -l | grep Disk')
-            data = ssh_client.send_command('parted -l | grep Disk')[0]
+            data = results['parted -l | grep Disk'][0]
             for line in data.splitlines():
                 print('\t%s' % line)
             assert '107' in data
@@ -645,120 +2838,36 @@ class TestGroup:
         self.set_up()
 
         print('Running test 11...\n')
-        driver = self.driver
 
-        # Select machine and stop it
+        # Stop machine (5 mins)
         print("Stopping VM %s..." % self.ubuntu_config['VM Name'])
-        elem = driver.find_element_by_xpath(
-            "//a[contains(text(), '%s')]/../../td/input" % self.ubuntu_config['VM Name'])
-        if not elem.is_selected():
-            elem.click()
-        driver.find_element_by_xpath("//a[contains(text(), 'Power')]").click()
-        driver.find_element_by_xpath("//a[contains(text(), 'Power off')]").click()
-        WebDriverWait(driver, 30).until(
-            EC.visibility_of_element_located(
-                (By.XPATH, "//button[contains(@value, 'yes')]")
-            )
-        )
-        self.sleep(1)
-        driver.find_element_by_xpath("//button[contains(@value, 'yes')]").click()
-
-        # Wait for machine to stop (5 mins)
-        WebDriverWait(driver, 300).until(
-            EC.text_to_be_present_in_element(
-                (By.XPATH,
-                 "//a[contains(text(), '%s')]/../../td[contains(@class, 'status')]" % self.ubuntu_config['VM Name']),
-                'off'
-            )
-        )
+        self.lifecycle.ensure_state(self.ubuntu_config['VM Name'], 'off')
         print('\t...stopped\n')
 
-        # Go to reconfigure page
+        # Reconfigure VM (5 mins)
         print('Reconfiguring VM %s...' % self.ubuntu_config['VM Name'])
-        url = driver.current_url
-        url = url[:len(url) - 1] + '/' + self.ubuntu_config['VM id'] + '/edit'
-        driver.get(url)
-
-        # Wait for price to load
-        try:
-            driver.find_element_by_xpath("//div[contains(@class, 'period')]")
-            WebDriverWait(driver, 30).until(
-                EC.visibility_of_element_located(
-                    (By.XPATH, "//div[contains(text(), 'per month')]")
-                )
-            )
-        except NoSuchElementException:
-            self.sleep(8)
-
-        # Reconfigure VM
-        # vCPU
-        elem = driver.find_element_by_id('f_input_vcpus')
-        vcpus = elem.get_attribute('value').strip()
-        elem.send_keys(Keys.CONTROL + 'a')
-        self.sleep()
-        elem.send_keys(Keys.DELETE)
-        elem.send_keys('%s' % '2')
-        print('\tvCPU: %s -> %s' % (vcpus, '2'))
-
-        # RAM
-        elem = driver.find_element_by_xpath("//input[contains(@id, 'f_input_memory')]")
-        ram = elem.get_attribute('value').strip()
-        elem.send_keys(Keys.CONTROL + 'a')
-        self.sleep()
-        elem.send_keys(Keys.DELETE)
-        elem.send_keys('%s' % '4096')
-        print('\tRAM: %s -> %s' % (ram, '4096'))
-
-        try:
-            driver.find_element_by_xpath("//button[contains(@id, 'createButton')]").click()
-        except NoSuchElementException:
-            # Call script to emulate button click
-            self.sleep()
-            driver.execute_script(self.reconfigure_script)
-
-        # Wait for machine to rebuild (5 mins)
-        driver.back()
-        self.sleep()
-        driver.refresh()
-        WebDriverWait(driver, 300).until(
-            EC.text_to_be_present_in_element(
-                (By.XPATH,
-                 "//a[contains(text(), '%s')]/../../td[contains(@class, 'status')]" % self.ubuntu_config['VM Name']),
-                'off'
-            )
-        )
+        self.reconfigure_vm(self.ubuntu_config, '2', '4096')
         print('\t...reconfigured\n')
 
-        # Start VM
+        # Start VM (5 mins)
         print("Starting VM %s..." % self.ubuntu_config['VM Name'])
-        elem = driver.find_element_by_xpath(
-            "//a[contains(text(), '%s')]/../../td/input" % self.ubuntu_config['VM Name'])
-        if not elem.is_selected():
-            elem.click()
-        driver.find_element_by_xpath("//a[contains(text(), 'Power')]").click()
-        driver.find_element_by_xpath("//a[contains(text(), 'Power on')]").click()
-
-        # Wait for machine to start (5 mins)
-        WebDriverWait(driver, 300).until(
-            EC.text_to_be_present_in_element(
-                (By.XPATH,
-                 "//a[contains(text(), '%s')]/../../td[contains(@class, 'status')]" % self.ubuntu_config['VM Name']),
-                'on'
-            )
-        )
+        self.lifecycle.ensure_state(self.ubuntu_config['VM Name'], 'on')
         print('\t...started\n')
 
         # Start vm-side testing
         print('Starting vm-side testing...\n')
-        ssh_client = SSHClient.get_ssh_client(self.ubuntu_config['Public ip'], 'root',
+        ssh_client = self.remote.get_ssh_client(self.ubuntu_config['Public ip'], 'root',
                                               self.ubuntu_config['Password'])
 
         if ssh_client is None:
-            print('\t...SSH connection refused after 5 retries')
+            print('\t...SSH connection refused')
         else:
+            results = ssh_client.run_parallel(['cat /proc/cpuinfo | grep processor',
+                                               'cat /proc/meminfo | grep MemTotal'])
+
             # Check processor
             print('Running: cat /proc/cpuinfo | grep processor')
-            data = ssh_client.send_command('cat /proc/cpuinfo | grep processor')[0]
+            data = results['cat /proc/cpuinfo | grep processor'][0]
             for line in data.splitlines():
                 print('\t%s' % line)
             assert '1' in data
@@ -767,7 +2876,7 @@ class TestGroup:
 
             # Check RAM
             print('\nRunning: cat /proc/meminfo | grep MemTotal')
-            data = ssh_client.send_command('cat /proc/meminfo | grep MemTotal')[0]
+            data = results['cat /proc/meminfo | grep MemTotal'][0]
             for line in data.splitlines():
                 print('\t%s' % line)
             assert '4047756' in data
@@ -784,120 +2893,36 @@ class TestGroup:
         self.set_up()
 
         print('Running test 12...\n')
-        driver = self.driver
 
-        # Select machine and stop it
+        # Stop machine (5 mins)
         print("Stopping VM %s..." % self.ubuntu_config['VM Name'])
-        elem = driver.find_element_by_xpath(
-            "//a[contains(text(), '%s')]/../../td/input" % self.ubuntu_config['VM Name'])
-        if not elem.is_selected():
-            elem.click()
-        driver.find_element_by_xpath("//a[contains(text(), 'Power')]").click()
-        driver.find_element_by_xpath("//a[contains(text(), 'Power off')]").click()
-        WebDriverWait(driver, 30).until(
-            EC.visibility_of_element_located(
-                (By.XPATH, "//button[contains(@value, 'yes')]")
-            )
-        )
-        self.sleep(1)
-        driver.find_element_by_xpath("//button[contains(@value, 'yes')]").click()
-
-        # Wait for machine to stop (5 mins)
-        WebDriverWait(driver, 300).until(
-            EC.text_to_be_present_in_element(
-                (By.XPATH,
-                 "//a[contains(text(), '%s')]/../../td[contains(@class, 'status')]" % self.ubuntu_config['VM Name']),
-                'off'
-            )
-        )
+        self.lifecycle.ensure_state(self.ubuntu_config['VM Name'], 'off')
         print('\t...stopped\n')
 
-        # Go to reconfigure page
+        # Reconfigure VM (5 mins)
         print('Reconfiguring VM %s...' % self.ubuntu_config['VM Name'])
-        url = driver.current_url
-        url = url[:len(url) - 1] + '/' + self.ubuntu_config['VM id'] + '/edit'
-        driver.get(url)
-
-        # Wait for price to load
-        try:
-            driver.find_element_by_xpath("//div[contains(@class, 'period')]")
-            WebDriverWait(driver, 30).until(
-                EC.visibility_of_element_located(
-                    (By.XPATH, "//div[contains(text(), 'per month')]")
-                )
-            )
-        except NoSuchElementException:
-            self.sleep(8)
-
-        # Reconfigure VM
-        # vCPU
-        elem = driver.find_element_by_id('f_input_vcpus')
-        vcpus = elem.get_attribute('value').strip()
-        elem.send_keys(Keys.CONTROL + 'a')
-        self.sleep()
-        elem.send_keys(Keys.DELETE)
-        elem.send_keys('%s' % '16')
-        print('\tvCPU: %s -> %s' % (vcpus, '16'))
-
-        # RAM
-        elem = driver.find_element_by_xpath("//input[contains(@id, 'f_input_memory')]")
-        ram = elem.get_attribute('value').strip()
-        elem.send_keys(Keys.CONTROL + 'a')
-        self.sleep()
-        elem.send_keys(Keys.DELETE)
-        elem.send_keys('%s' % '32768')
-        print('\tRAM: %s -> %s' % (ram, '32768'))
-
-        try:
-            driver.find_element_by_xpath("//button[contains(@id, 'createButton')]").click()
-        except NoSuchElementException:
-            # Call script to emulate button click
-            self.sleep()
-            driver.execute_script(self.reconfigure_script)
-
-        # Wait for machine to rebuild (5 mins)
-        driver.back()
-        self.sleep()
-        driver.refresh()
-        WebDriverWait(driver, 300).until(
-            EC.text_to_be_present_in_element(
-                (By.XPATH,
-                 "//a[contains(text(), '%s')]/../../td[contains(@class, 'status')]" % self.ubuntu_config['VM Name']),
-                'off'
-            )
-        )
+        self.reconfigure_vm(self.ubuntu_config, '16', '32768')
         print('\t...reconfigured\n')
 
-        # Start VM
+        # Start VM (5 mins)
         print("Starting VM %s..." % self.ubuntu_config['VM Name'])
-        elem = driver.find_element_by_xpath(
-            "//a[contains(text(), '%s')]/../../td/input" % self.ubuntu_config['VM Name'])
-        if not elem.is_selected():
-            elem.click()
-        driver.find_element_by_xpath("//a[contains(text(), 'Power')]").click()
-        driver.find_element_by_xpath("//a[contains(text(), 'Power on')]").click()
-
-        # Wait for machine to start (5 mins)
-        WebDriverWait(driver, 300).until(
-            EC.text_to_be_present_in_element(
-                (By.XPATH,
-                 "//a[contains(text(), '%s')]/../../td[contains(@class, 'status')]" % self.ubuntu_config['VM Name']),
-                'on'
-            )
-        )
+        self.lifecycle.ensure_state(self.ubuntu_config['VM Name'], 'on')
         print('\t...started\n')
 
         # Start vm-side testing
         print('Starting vm-side testing...\n')
-        ssh_client = SSHClient.get_ssh_client(self.ubuntu_config['Public ip'], 'root',
+        ssh_client = self.remote.get_ssh_client(self.ubuntu_config['Public ip'], 'root',
                                               self.ubuntu_config['Password'])
 
         if ssh_client is None:
-            print('\t...SSH connection refused after 5 retries')
+            print('\t...SSH connection refused')
         else:
+            results = ssh_client.run_parallel(['cat /proc/cpuinfo | grep processor',
+                                               'cat /proc/meminfo | grep MemTotal'])
+
             # Check processor
             print('Running: cat /proc/cpuinfo | grep processor')
-            data = ssh_client.send_command('cat /proc/cpuinfo | grep processor')[0]
+            data = results['cat /proc/cpuinfo | grep processor'][0]
             for line in data.splitlines():
                 print('\t%s' % line)
             assert '15' in data
@@ -906,7 +2931,7 @@ class TestGroup:
 
             # Check RAM
             print('\nRunning: cat /proc/meminfo | grep MemTotal')
-            data = ssh_client.send_command('cat /proc/meminfo | grep MemTotal')[0]
+            data = results['cat /proc/meminfo | grep MemTotal'][0]
             for line in data.splitlines():
                 print('\t%s' % line)
             assert '32947276' in data
@@ -964,58 +2989,30 @@ class TestGroup:
         driver.refresh()
 
         # Wait for machine to create (5 mins)
-        WebDriverWait(driver, 300).until(
-            EC.text_to_be_present_in_element(
-                (By.XPATH,
-                 "//a[contains(text(), '%s')]/../../td[contains(@class, 'status')]" % self.centos_config['VM Name']),
-                'off'
-            )
-        )
+        self.lifecycle.ensure_state(self.centos_config['VM Name'], 'off')
+        self.admission.created(self.centos_config['VM Name'])
         print('\t...created\n')
 
         # Get and remember VM id (it is used to get reconfigure page in the latter tests)
-        href = driver.find_element_by_xpath(
-            "//a[contains(text(), '%s')]" % self.centos_config['VM Name']).get_attribute(
-            'href')
-        vm_id = href[href.rfind('/') + 1:]
-        self.centos_config['VM id'] = vm_id
+        self.centos_config['VM id'] = self.vms[self.centos_config['VM Name']].vm_id
+        self.ledger.identify(self.centos_config['VM Name'], self.centos_config['VM id'])
 
-        # Start VM
+        # Start VM (5 mins)
         print("Starting VM %s..." % self.centos_config['VM Name'])
-        elem = driver.find_element_by_xpath(
-            "//a[contains(text(), '%s')]/../../td/input" % self.centos_config['VM Name'])
-        if not elem.is_selected():
-            elem.click()
-        driver.find_element_by_xpath("//a[contains(text(), 'Power')]").click()
-        driver.find_element_by_xpath("//a[contains(text(), 'Power on')]").click()
-
-        # Wait for machine to start (5 mins)
-        WebDriverWait(driver, 300).until(
-            EC.text_to_be_present_in_element(
-                (By.XPATH,
-                 "//a[contains(text(), '%s')]/../../td[contains(@class, 'status')]" % self.centos_config['VM Name']),
-                'on'
-            )
-        )
+        self.lifecycle.ensure_state(self.centos_config['VM Name'], 'on')
         print('\t...started\n')
 
         # Ping public ip
         self.sleep(5)
-        self.centos_config['Public ip'] = driver.find_element_by_xpath(
-            "//a[contains(text(), '%s')]/../../td[4]" % self.centos_config['VM Name']).text.strip()
+        self.centos_config['Public ip'] = self.vms[self.centos_config['VM Name']].public_ip
+        self.keystore.bind(self.centos_config['Public ip'], self.centos_config['VM Name'])
         print('Pinging public ip: ' + self.centos_config['Public ip'])
-        status = ping(self.centos_config['Public ip'])
-        try:
-            assert 0 == status
-        except AssertionError:
-            # Wait a bit longer if not available in first time and retry
-            self.sleep(10)
-            status = ping(self.centos_config['Public ip'])
-            assert 0 == status
+        status = self.remote.ping(self.centos_config['Public ip'])
+        assert 0 == status
         print('\t...pinging public ip OK\n')
 
         # Obtain private ip and gateway
-        driver.find_element_by_xpath("//a[contains(text(), '%s')]" % self.centos_config['VM Name']).click()
+        driver.get(self.vms[self.centos_config['VM Name']].href)
         self.sleep()
         self.centos_config['Private ip'] = driver.find_element_by_xpath(
             "//td[contains(text(), 'Private IP')]/../td[2]").text.strip()
@@ -1033,7 +3030,7 @@ class TestGroup:
 
         # Check private ip
         print('Running: ifconfig:')
-        data = send_single_command(ip, user, psswd, 'ifconfig')[0]
+        data = self.remote.send_single_command(ip, user, psswd, 'ifconfig')[0]
         for line in data.splitlines():
             print('\t%s' % line)
         assert self.centos_config['Private ip'] in data
@@ -1041,7 +3038,8 @@ class TestGroup:
 
         # Ping gateway
         print('Running: ping -c 4 %s' % self.centos_config['Gateway'])
-        data, status = send_single_command(ip, user, psswd, 'ping -c4 %s' % self.centos_config['Gateway'])
+        data, status = self.remote.send_single_command(ip, user, psswd,
+                                                       'ping -c4 %s' % self.centos_config['Gateway'])
         for line in data.splitlines():
             print('\t%s' % line)
         assert 0 == status
@@ -1065,51 +3063,679 @@ class TestGroup:
 
         # Install epel-release.noarch
         print('Running: yum -y install epel-release.noarch:')
-        data = send_single_command(ip, user, psswd, 'yum -y install epel-release.noarch')[0]
-        for line in data.splitlines():
-            print('\t%s' % line)
-        assert 'Complete' in data
+        result = self.remote.stream_single_command(ip, user, psswd, 'yum -y install epel-release.noarch')
+        line = result.find('Complete')
+        result.wait()
+        assert line is not None, result.output()
+        print('\t%s' % line)
 
         # Installing iperf.x86_64
         print('Running: yum -y install iperf.x86_64')
-        data, status = send_single_command(ip, user, psswd, 'yum -y install iperf.x86_64')
-        for line in data.splitlines():
-            print('\t%s' % line)
-        assert 'Complete' in data
+        result = self.remote.stream_single_command(ip, user, psswd, 'yum -y install iperf.x86_64')
+        line = result.find('Complete')
+        result.wait()
+        assert line is not None, result.output()
+        print('\t%s' % line)
 
         # Checking iperf
         print('Running: rpm -qa | grep iperf')
-        data, status = send_single_command(ip, user, psswd, 'rpm -qa | grep iperf')
-        for line in data.splitlines():
-            print('\t%s' % line)
-        assert 'iperf' in data
+        result = self.remote.stream_single_command(ip, user, psswd, 'rpm -qa | grep iperf')
+        line = result.find('iperf')
+        result.abort()
+        assert line is not None, result.output()
+        print('\t%s' % line)
         print('\t...iperf OK\n')
 
         print('...finished test 14\n')
 
-    def run_tests(self):
-        """Specifies the tests and the order to run"""
-        self.test_008()
+    def benchmark_vm(self, config=None):
+        """Disk and CPU performance stage.
+        Benchmarks the VM (Ubuntu by default) and checks results against
+        thresholds of its storage tier ('HDD 1 Type').
+        """
+        config = config or self.ubuntu_config
+        print('Running disk and CPU benchmark on %s...\n' % config['VM Name'])
+        ip = config['Public ip']
+        psswd = config['Password']
+
+        def run(command):
+            return self.remote.send_single_command(ip, 'root', psswd, command)
+
+        benchmark = VMBenchmark(run)
+        results = benchmark.disk()
+        results.update(benchmark.cpu())
+        for name, value in sorted(results.items()):
+            print('\t%s: %.2f' % (name, value))
+
+        tier = config.get('HDD 1 Type', 'default')
+        spec = '%s, %d vCPU, %s MB RAM, %s' % (config['OS'], results['vCPU'], config.get('RAM'), tier)
+        self.benchmark_results.setdefault(spec, []).append(results)
+        config.setdefault('Benchmarks', []).append(results)
+
+        failures = benchmark.check(results, tier)
+        for failure in failures:
+            print('\tBelow %s threshold: %s' % (tier, failure))
+        assert not failures
+        print('\t...%s performance OK\n' % tier)
+
+        print('...finished disk and CPU benchmark\n')
+
+    def benchmark_iperf(self, streams=4, duration=10):
+        """Network performance stage.
+        Measures throughput from the runner to CentOS VM with iperf (installed in test 14)
+        and checks it against configured bandwidth.
+        """
+        print('Running iperf benchmark...\n')
+        ip = self.centos_config['Public ip']
+        psswd = self.centos_config['Password']
 
-        self.test_011()
-        self.test_012()
+        def server_run(command):
+            return self.remote.send_single_command(ip, 'root', psswd, command)
 
-        self.test_013()
+        benchmark = IperfBenchmark(ip, server_run=server_run, client_run=self.remote.run_local)
+        self.centos_config['Iperf'] = benchmark.run(self.centos_config['Bandwidth'], streams, duration)
+        print('\t...bandwidth OK\n')
 
-        self.test_014()
+        print('...finished iperf benchmark\n')
 
+    def test_firewall(self, timeout=1.0):
+        """Checks that ports of created VMs are reachable as their firewall rules say.
+        All VMs are scanned at once.
+        """
+        print('Running firewall test...\n')
+        configs = [config for config in (self.ubuntu_config, self.centos_config)
+                   if config.get('Public ip') and 'Firewall rules' in config]
+        results = verify_firewalls(dict((config['Public ip'], config['Firewall rules']) for config in configs),
+                                   timeout)
+        mismatches = []
+        for config in configs:
+            config['Firewall'] = results[config['Public ip']]
+            print('VM %s (%s):' % (config['VM Name'], config['Public ip']))
+            for port, state in sorted(config['Firewall']['Ports'].items()):
+                print('\t%s: %s' % (port, state))
+            for mismatch in config['Firewall']['Mismatches']:
+                print('\tMismatch: %s' % mismatch)
+            mismatches += config['Firewall']['Mismatches']
+        assert not mismatches, '; '.join(mismatches)
+        print('\t...firewall OK\n')
+
+        print('...finished firewall test\n')
+
+    def run_tests(self, tests=None, cleanup=True):
+        """Specifies the tests and the order to run.
+        Runs given test names instead, if specified (see SCENARIOS).
+        A failed test does not stop the run, tests depending on it are skipped
+        (see DEPENDENCIES). Returns report of TestRunner with latencies
+        of VM power transitions in 'Lifecycle'.
+        VMs created by the run are destroyed afterwards; cleanup is reported
+        as the last result, so its failure does not lose the report.
+        """
+        self.sweep_before_run()
+        runner = TestRunner(self)
+        report = None
+        try:
+            report = runner.run(tests or SCENARIOS['all'])
+        finally:
+            if cleanup and self.datacenter_url is not None:
+                if report is None:
+                    # Run interrupted, there is no report to add to
+                    self.cleanup()
+                else:
+                    report = runner.add(report, runner.run_test('cleanup'))
+            PROGRESS.save_durations()
+        report['Lifecycle'] = self.lifecycle.metrics
+        return report
+
+
+class StepLog:
+    """Wrapper of stdout, which times test steps. Tests report finished
+    steps with '\t...<step>' lines, so step duration is the time since
+    the previous step (or the test start), which covers its assertions.
+    Only output of the thread running the test is parsed, lines printed
+    by other threads are passed through.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.steps = []
+        self.last = time.time()
+        self.thread = threading.current_thread()
+        self.__buffer = ''
+
+    def write(self, text):
+        self.stream.write(text)
+        if threading.current_thread() is not self.thread:
+            return len(text)
+        self.__buffer += text
+        lines = self.__buffer.split('\n')
+        self.__buffer = lines.pop()
+        for line in lines:
+            if line.startswith('\t...'):
+                now = time.time()
+                self.steps.append({'Name': line[4:].strip(), 'Status': 'passed', 'Duration': now - self.last})
+                self.last = now
+        return len(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class TestRunner:
+    """Runs tests of TestGroup one by one and collects results.
+    Failure of a test is recorded and the run goes on; tests depending on
+    a test which did not pass are skipped. Every result has duration of the
+    test and of its steps, failed assertion is recorded as the last step.
+    """
+
+    def __init__(self, group, dependencies=DEPENDENCIES):
+        self.group = group
+        self.dependencies = dependencies
 
-def main():
-    if len(sys.argv) != 3:
-        print('Usage: python3 TestGroup.py <email> <password> <httpaddress>')
-        sys.exit(0)
+    @staticmethod
+    def __failure(status, started_step):
+        """Returns failed step for exception being handled: assertion source and line."""
+        exc_type, exc, tb = sys.exc_info()
+        test_frames = traceback.extract_tb(tb)[1:]
+        frames = [frame for frame in test_frames if os.path.abspath(frame.filename) == os.path.abspath(__file__)]
+        frame = (frames or test_frames)[-1]
+        return {'Name': frame.line or exc_type.__name__, 'Status': status, 'Duration': time.time() - started_step,
+                'Line': frame.lineno, 'Message': '%s: %s' % (exc_type.__name__, exc),
+                'Traceback': traceback.format_exc()}
+
+    def run_test(self, name):
+        """Runs single test and returns its result."""
+        result = {'Name': name, 'Started': time.time()}
+        log = StepLog(sys.stdout)
+        PROGRESS.test_started(name)
+        sys.stdout = log
+        try:
+            getattr(self.group, name)()
+            result['Status'] = 'passed'
+        except AssertionError:
+            result['Status'] = 'failed'
+            log.steps.append(self.__failure('failed', log.last))
+        except Exception:
+            result['Status'] = 'error'
+            log.steps.append(self.__failure('error', log.last))
+        finally:
+            sys.stdout = log.stream
+        PROGRESS.test_finished(name, result['Status'])
+        result['Duration'] = time.time() - result['Started']
+        result['Steps'] = log.steps
+        if result['Status'] != 'passed':
+            print(result['Steps'][-1]['Traceback'])
+        return result
+
+    def run(self, tests):
+        """Runs tests in order, returns report."""
+        started = time.time()
+        results = []
+        statuses = {}
+        for name in tests:
+            blocking = [dependency for dependency in self.dependencies.get(name, ())
+                        if statuses.get(dependency, 'passed') != 'passed']
+            if blocking:
+                print('Skipping %s: %s did not pass\n' % (name, ', '.join(blocking)))
+                result = {'Name': name, 'Started': time.time(), 'Status': 'skipped', 'Duration': 0.0,
+                          'Steps': [], 'Skipped': '%s did not pass' % ', '.join(blocking)}
+            else:
+                result = self.run_test(name)
+            statuses[name] = result['Status']
+            results.append(result)
+        return self.summary(started, results)
+
+    @staticmethod
+    def summary(started, results):
+        """Returns report of results."""
+        return {
+            'Started': started,
+            'Duration': time.time() - started,
+            'Passed': len([r for r in results if r['Status'] == 'passed']),
+            'Failed': len([r for r in results if r['Status'] in ('failed', 'error')]),
+            'Skipped': len([r for r in results if r['Status'] == 'skipped']),
+            'Tests': results,
+        }
+
+    def add(self, report, result):
+        """Returns report with another result, e.g. of cleanup after the tests."""
+        return self.summary(report['Started'], report['Tests'] + [result])
+
+
+def save_junit(report, path, suite='TestGroup'):
+    """Saves report of TestRunner as JUnit XML. Step durations are
+    saved as properties of the test case, latencies of VM power
+    transitions as properties of the suite.
+    """
+    root = xml.etree.ElementTree.Element('testsuite', {
+        'name': suite, 'tests': str(len(report['Tests'])), 'failures': str(len(
+            [r for r in report['Tests'] if r['Status'] == 'failed'])),
+        'errors': str(len([r for r in report['Tests'] if r['Status'] == 'error'])),
+        'skipped': str(report['Skipped']), 'time': '%.3f' % report['Duration'],
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(report['Started']))})
+    if report.get('Lifecycle'):
+        properties = xml.etree.ElementTree.SubElement(root, 'properties')
+        for number, transition in enumerate(report['Lifecycle']):
+            xml.etree.ElementTree.SubElement(properties, 'property', {
+                'name': 'transition %02d %s: %s -> %s' % (number + 1, transition['VM Name'], transition['From'],
+                                                          transition['To']),
+                'value': '%.3f' % transition['Latency']})
+    for result in report['Tests']:
+        case = xml.etree.ElementTree.SubElement(root, 'testcase', {
+            'classname': suite, 'name': result['Name'], 'time': '%.3f' % result['Duration']})
+        if result['Steps']:
+            properties = xml.etree.ElementTree.SubElement(case, 'properties')
+            for number, step in enumerate(result['Steps']):
+                xml.etree.ElementTree.SubElement(properties, 'property', {
+                    'name': 'step %02d %s: %s' % (number + 1, step['Status'], step['Name']),
+                    'value': '%.3f' % step['Duration']})
+        if result['Status'] in ('failed', 'error'):
+            step = result['Steps'][-1]
+            element = xml.etree.ElementTree.SubElement(case, 'failure' if result['Status'] == 'failed' else 'error',
+                                                       {'message': step['Message']})
+            element.text = step['Traceback']
+        elif result['Status'] == 'skipped':
+            xml.etree.ElementTree.SubElement(case, 'skipped', {'message': result['Skipped']})
+    xml.etree.ElementTree.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def run_job(job):
+    """Runs scenario of a single (account, region, scenario) job
+    with its own WebDriver and returns result dict.
+    """
+    result = {'Email': job['Email'], 'Region': job['Region'], 'Scenario': job['Scenario'],
+              'Address': job['Address'], 'Worker': os.getpid(), 'Started': time.time()}
+    tests = None
+    try:
+        tests = TestGroup(job['Email'], job['Password'], job['Address'])
+        report = tests.run_tests(SCENARIOS[job['Scenario']])
+        result['Tests'] = report['Tests']
+        result['Status'] = 'passed' if report['Failed'] == 0 and report['Skipped'] == 0 else 'failed'
+    except AssertionError:
+        result['Status'] = 'failed'
+        result['Error'] = traceback.format_exc()
+    except Exception:
+        result['Status'] = 'error'
+        result['Error'] = traceback.format_exc()
+    finally:
+        if tests is not None:
+            result['Configs'] = {'Ubuntu': tests.ubuntu_config, 'CentOS': tests.centos_config}
+            result['Lifecycle'] = tests.lifecycle.metrics
+            try:
+                tests.driver.quit()
+            except Exception:
+                pass
+    result['Duration'] = time.time() - result['Started']
+    result['Retries'] = RETRY.stats()
+    return result
+
+
+def _job_process(job, conn):
+    """Worker process entry: runs job and sends result back through the pipe.
+    The worker leads its own process group, so a stuck worker can be killed
+    together with its browser.
+    """
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    try:
+        conn.send(run_job(job))
+    finally:
+        conn.close()
+
+
+def _kill_process(process):
+    """Kills worker process with its whole process group."""
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+    process.join()
+
+
+class Coordinator:
+    """Coordinator splits (account, region, scenario) jobs across worker processes.
+    Every job runs in a fresh process with its own WebDriver, so a crashed
+    or hung job does not affect the others. Jobs running longer than
+    timeout seconds are killed.
+    Jobs of the same account are throttled: at most max_concurrent of them
+    run at once, and they start at least min_interval seconds apart, so the
+    control plane is not flooded by one tenant.
+    Job file format (JSON):
+        {"Accounts": [{"Email": ..., "Password": ..., "Regions": {<region>: <httpaddress>}}],
+         "Scenarios": ["ubuntu", "centos"], "Min interval": 30, "Max concurrent": 1, "Timeout": 3600}
+    """
 
-    email = sys.argv[1]
-    password = sys.argv[2]
-    httpaddress = sys.argv[3]
+    def __init__(self, jobs, workers=2, min_interval=30, max_concurrent=1, timeout=3600):
+        self.jobs = list(jobs)
+        self.workers = workers
+        self.min_interval = min_interval
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
 
-    tests = TestGroup(email, password, httpaddress)
-    tests.run_tests()
+    @staticmethod
+    def from_file(path, workers=2):
+        """Creates coordinator with jobs from JSON file."""
+        with open(path) as f:
+            spec = json.load(f)
+        jobs = []
+        for account in spec['Accounts']:
+            for region, address in sorted(account['Regions'].items()):
+                for scenario in spec.get('Scenarios', ['all']):
+                    jobs.append({'Email': account['Email'], 'Password': account['Password'],
+                                 'Region': region, 'Address': address, 'Scenario': scenario})
+        return Coordinator(jobs, workers, spec.get('Min interval', 30), spec.get('Max concurrent', 1),
+                           spec.get('Timeout', 3600))
+
+    @staticmethod
+    def __failed(job, status, error, started):
+        """Returns result for job, whose worker did not report back."""
+        return {'Email': job['Email'], 'Region': job['Region'], 'Scenario': job['Scenario'],
+                'Address': job['Address'], 'Status': status, 'Error': error,
+                'Started': started, 'Duration': time.time() - started}
+
+    def run(self):
+        """Runs all jobs and returns merged report."""
+        started = time.time()
+        pending = list(self.jobs)
+        workers = {}
+        running = {}
+        last_start = {}
+        results = []
+
+        def finish(result):
+            running[result['Email']] -= 1
+            results.append(result)
+            print('\t%s/%s/%s: %s (%.0fs)' % (result['Email'], result['Region'], result['Scenario'],
+                                               result['Status'], result['Duration']))
+
+        while pending or workers:
+            for job in list(pending):
+                if len(workers) >= self.workers:
+                    break
+                account = job['Email']
+                if running.get(account, 0) >= self.max_concurrent \
+                        or time.time() - last_start.get(account, 0) < self.min_interval:
+                    continue
+                pending.remove(job)
+                running[account] = running.get(account, 0) + 1
+                last_start[account] = time.time()
+                print('Dispatching %s/%s/%s' % (account, job['Region'], job['Scenario']))
+                conn, child_conn = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=_job_process, args=(job, child_conn), daemon=True)
+                process.start()
+                child_conn.close()
+                workers[conn] = (process, job, time.time())
+
+            for conn in multiprocessing.connection.wait(list(workers), timeout=1):
+                process, job, job_started = workers.pop(conn)
+                try:
+                    result = conn.recv()
+                except EOFError:
+                    process.join()
+                    result = self.__failed(job, 'crashed', 'Worker exited with code %s' % process.exitcode,
+                                           job_started)
+                conn.close()
+                process.join()
+                finish(result)
+
+            for conn, (process, job, job_started) in list(workers.items()):
+                if self.timeout is not None and time.time() - job_started > self.timeout:
+                    _kill_process(process)
+                    del workers[conn]
+                    conn.close()
+                    finish(self.__failed(job, 'timeout', 'Worker killed after %ss' % self.timeout, job_started))
+
+        return {
+            'Started': started,
+            'Duration': time.time() - started,
+            'Passed': len([r for r in results if r['Status'] == 'passed']),
+            'Failed': len([r for r in results if r['Status'] != 'passed']),
+            'Jobs': results,
+        }
+
+
+def run_isolated(email, password, httpaddress, chains=('ubuntu', 'centos'), timeout=3600):
+    """Runs every test chain of one account in its own worker process.
+    Chains use different VMs, so they run in parallel. Returns merged report,
+    VM configs of each chain come back in its 'Configs' field.
+    """
+    jobs = [{'Email': email, 'Password': password, 'Region': 'default', 'Address': httpaddress, 'Scenario': chain}
+            for chain in chains]
+    return Coordinator(jobs, len(jobs), min_interval=0, max_concurrent=len(jobs), timeout=timeout).run()
+
+
+def save_report(report, path):
+    """Saves report (of Coordinator or TestRunner) as JSON and prints summary."""
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('%d passed, %d failed, report saved to %s' % (report['Passed'], report['Failed'], path))
+
+
+# Time of module import, lazily imported modules are in LazyModule.loaded
+IMPORT_TIME = time.time() - _import_started
+
+
+def report_imports(budget):
+    """Prints import times and returns False if they exceed budget milliseconds."""
+    total = IMPORT_TIME + sum(LazyModule.loaded.values())
+    details = ', '.join('%s %.0f ms' % (name, 1000 * seconds) for name, seconds in sorted(LazyModule.loaded.items()))
+    sys.stderr.write('Imports: %.0f ms (module %.0f ms%s), budget %.0f ms\n' % (
+        1000 * total, 1000 * IMPORT_TIME, ', ' + details if details else '', budget))
+    return 1000 * total <= budget
+
+
+def command_run(args):
+    """Runs tests against the portal, isolated, recorded or replayed."""
+    global TIME_SCALE
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    # Retry statistics are saved next to the report
+    retries_path = args.report + '.retries.json'
+
+    if args.isolated:
+        # Every test chain in its own worker process and browser
+        chains = ('ubuntu', 'centos') if args.scenario == 'all' else (args.scenario,)
+        report = run_isolated(args.email, args.password, args.httpaddress, chains, timeout=args.timeout)
+        save_report(report, args.report + '.json')
+        with open(retries_path, 'w') as f:
+            json.dump(dict((job['Scenario'], job.get('Retries', {})) for job in report['Jobs']), f, indent=1)
+        return 0 if report['Failed'] == 0 else 1
+
+    tests = args.tests or SCENARIOS[args.scenario]
+    if args.record:
+        # Run against live portal and VMs, recording every call
+        recorder = Recorder(args.record)
+        try:
+            report = TestGroup(args.email, args.password, args.httpaddress, session=recorder).run_tests(tests)
+        finally:
+            recorder.close()
+            RETRY.export(retries_path)
+    elif args.replay:
+        # Run against recording: no browser, no network, optionally time-compressed
+        TIME_SCALE = args.time_scale
+        player = Player(args.replay, TIME_SCALE)
+        scratch = tempfile.mkdtemp()
+        PROGRESS.durations_path = os.path.join(scratch, 'durations.json')
+        try:
+            group = TestGroup(args.email, args.password, args.httpaddress,
+                              RunLedger(os.path.join(scratch, 'ledger.json')), player,
+                              CredentialStore(os.path.join(scratch, 'store'), encrypted=False))
+            group.admission.path = os.path.join(scratch, 'admission.json')
+            report = group.run_tests(tests)
+        finally:
+            shutil.rmtree(scratch)
+            player.report()
+            RETRY.export(retries_path)
+    else:
+        try:
+            report = TestGroup(args.email, args.password, args.httpaddress).run_tests(tests)
+        finally:
+            RETRY.export(retries_path)
+    save_report(report, args.report + '.json')
+    save_junit(report, args.report + '.xml')
+    return 0 if report['Failed'] == 0 else 1
+
+
+def command_cleanup(args):
+    """Destroys orphans of crashed runs, or VMs matching the pattern."""
+    tests = TestGroup(args.email, args.password, args.httpaddress)
+    try:
+        tests.set_up()
+        if args.pattern:
+            tests.cleanup(args.pattern)
+        else:
+            tests.sweep_orphans()
+    finally:
+        tests.driver.quit()
+    return 0
+
+
+def command_ui(args):
+    """Lists VMs of the account, optionally bringing them to power states first."""
+    tests = TestGroup(args.email, args.password, args.httpaddress)
+    try:
+        tests.set_up()
+        if args.state:
+            tests.lifecycle.ensure_states(dict(state.split('=', 1) for state in args.state))
+        for name in tests.vms.names():
+            vm = tests.vms[name]
+            print('%s\t%s\t%s\t%s' % (vm.name, vm.vm_id, vm.status, vm.public_ip))
+    finally:
+        tests.driver.quit()
+    return 0
+
+
+def command_ssh(args):
+    """Runs commands on VM over one SSH connection, checks exit status and output."""
+    ssh_client = SSHClient(args.address, args.username, args.password, args.deadline)
+    try:
+        results = ssh_client.run_parallel(args.commands, args.max_channels)
+    finally:
+        ssh_client.close()
+    failed = False
+    for command in args.commands:
+        data, status = results[command]
+        print('$ %s (exit status %d)' % (command, status))
+        for line in data.splitlines():
+            print('\t%s' % line)
+        failed = failed or status != 0
+    for text in args.expect or ():
+        if not any(text in data for data, status in results.values()):
+            print('Not found in output: %s' % text)
+            failed = True
+    return 1 if failed else 0
+
+
+def command_firewall(args):
+    """Scans ports of a host against firewall rules, e.g. a local listener."""
+    rules = [(name, True) for name in args.rules]
+    result = verify_firewalls({args.address: rules}, args.timeout)[args.address]
+    for port, state in sorted(result['Ports'].items()):
+        print('%s: %s' % (port, state))
+    for mismatch in result['Mismatches']:
+        print('Mismatch: %s' % mismatch)
+    return 1 if result['Mismatches'] else 0
+
+
+def command_coordinate(args):
+    """Multi-tenant mode: jobs from file are run by worker processes.
+    Progress of workers is not served as metrics, results are in the report.
+    """
+    report = Coordinator.from_file(args.jobs, args.workers).run()
+    save_report(report, args.report)
+    return 0 if report['Failed'] == 0 else 1
+
+
+def command_iperf(args):
+    """Benchmark over loopback, checks the stage without any VM."""
+    IperfBenchmark('127.0.0.1').run(args.bandwidth, streams=2, duration=3)
+    return 0
+
+
+def command_dashboard(args):
+    """Live view of a run started with --metrics-port (not isolated)."""
+    show_dashboard(args.url)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='TestGroup.py', description='Tests of data center portal and its VMs.')
+    parser.add_argument('--import-budget', type=float, metavar='MS', default=os.environ.get('TESTGROUP_IMPORT_BUDGET'),
+                        help='print import time, exit with status 3 if it exceeds MS milliseconds')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    def add_command(name, func, help_text, account=True):
+        command = commands.add_parser(name, help=help_text, description=help_text)
+        command.set_defaults(func=func)
+        if account:
+            command.add_argument('email')
+            command.add_argument('password')
+            command.add_argument('httpaddress')
+        return command
+
+    command = add_command('run', command_run, 'Run tests (portal and SSH)')
+    command.add_argument('--scenario', choices=sorted(SCENARIOS), default='all', help='test chain to run')
+    command.add_argument('--tests', nargs='+', choices=SCENARIOS['all'], help='tests to run instead of scenario')
+    mode = command.add_mutually_exclusive_group()
+    mode.add_argument('--isolated', action='store_true', help='run every chain in its own worker process')
+    mode.add_argument('--record', metavar='FILE', help='record every portal and VM call to FILE')
+    mode.add_argument('--replay', metavar='FILE', help='replay recorded run without browser and network')
+    command.add_argument('--time-scale', type=float, default=0.0, help='scale of sleeps in replay (default 0)')
+    command.add_argument('--timeout', type=float, default=3600, help='worker timeout of isolated run')
+    command.add_argument('--report', default='report',
+                         help='report file prefix, .json, .xml (JUnit) and .retries.json are saved')
+    command.add_argument('--metrics-port', type=int, default=int(os.environ.get('TESTGROUP_METRICS_PORT', 0)),
+                         help='serve live metrics on this port')
+
+    command = add_command('cleanup', command_cleanup, 'Destroy orphan VMs of crashed runs (portal only)')
+    command.add_argument('--pattern', help='destroy VMs matching shell-style name pattern instead')
+
+    command = add_command('ui', command_ui, 'List VMs of the account (portal only)')
+    command.add_argument('--state', action='append', metavar='NAME=on|off', help='bring VM to power state first')
+
+    command = add_command('ssh', command_ssh, 'Run commands on VM over one SSH connection (SSH only)', account=False)
+    command.add_argument('address')
+    command.add_argument('username')
+    command.add_argument('password')
+    command.add_argument('commands', nargs='+', metavar='command')
+    command.add_argument('--expect', action='append', metavar='TEXT', help='text required in output')
+    command.add_argument('--deadline', type=float, default=120, help='connection deadline in seconds')
+    command.add_argument('--max-channels', type=int, default=4, help='commands running at once')
+
+    command = add_command('firewall', command_firewall, 'Check open ports of a host against firewall rules',
+                          account=False)
+    command.add_argument('address')
+    command.add_argument('rules', nargs='*', metavar='rule', help='enabled rules: %s' % ', '.join(FIREWALL_PORTS))
+    command.add_argument('--timeout', type=float, default=1.0, help='probe timeout in seconds')
+
+    command = add_command('coordinate', command_coordinate,
+                          'Run jobs of several accounts and regions (no live metrics, see the report)', account=False)
+    command.add_argument('jobs', help='jobs file, see Coordinator')
+    command.add_argument('--workers', type=int, default=2)
+    command.add_argument('--report', default='report.json')
+
+    command = add_command('iperf', command_iperf, 'Run iperf benchmark over loopback', account=False)
+    command.add_argument('bandwidth', nargs='?', default='50')
+
+    command = add_command('dashboard', command_dashboard, 'Show live progress of a run', account=False)
+    command.add_argument('url', nargs='?', default='http://127.0.0.1:9100/metrics')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run' and args.isolated and args.metrics_port:
+        # Workers keep their own progress, the endpoint would serve an empty one
+        parser.error('--metrics-port (or TESTGROUP_METRICS_PORT) does not work with --isolated')
+    if args.command == 'run' and args.isolated and args.tests:
+        # Workers run whole chains, see SCENARIOS
+        parser.error('--tests does not work with --isolated, use --scenario')
+    status = args.func(args)
+    if args.import_budget is not None and not report_imports(float(args.import_budget)):
+        status = status or 3
+    sys.exit(status)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,842 @@
+# -*- coding: utf-8 -*-
+"""Checks of TestGroup parts, which work without portal, VMs, selenium
+and paramiko: fake drivers and channels and local sockets stand in for them.
+"""
+
+import json
+import multiprocessing
+import re
+import socket
+import threading
+import time
+import types
+
+import pytest
+
+import TestGroup
+
+
+def test_parse_iperf_csv_tcp_streams_and_sum():
+    data = ('20260101120000,10.0.0.2,40000,10.0.0.1,5001,3,0.0-10.0,62500000,50000000\n'
+            '20260101120000,10.0.0.2,40001,10.0.0.1,5001,4,0.0-10.0,62500000,50000000\n'
+            '20260101120000,10.0.0.2,0,10.0.0.1,5001,-1,0.0-10.0,125000000,100000000\n')
+    result = TestGroup.parse_iperf_csv(data.encode('utf-8'))
+    assert result == {'Bandwidth': 100.0, 'Jitter': None, 'Loss': None, 'Streams': 2}
+
+
+def test_parse_iperf_csv_udp_uses_server_reports():
+    data = ('20260101120000,10.0.0.2,40000,10.0.0.1,5001,3,0.0-10.0,12500000,10000000\n'
+            '20260101120000,10.0.0.1,5001,10.0.0.2,40000,3,0.0-10.0,12000000,9600000,0.5,2,100,2.0,0\n'
+            '20260101120000,10.0.0.1,5001,10.0.0.2,40001,4,0.0-10.0,12000000,9600000,1.5,0,100,0.0,0\n')
+    result = TestGroup.parse_iperf_csv(data)
+    assert result['Bandwidth'] == pytest.approx(19.2)
+    assert result['Jitter'] == 1.5
+    assert result['Loss'] == 1.0
+    assert result['Streams'] == 2
+
+
+def test_parse_iperf_csv_without_report():
+    assert TestGroup.parse_iperf_csv('connect failed: Connection refused\n') == \
+        {'Bandwidth': 0.0, 'Jitter': None, 'Loss': None, 'Streams': 0}
+
+
+def test_iperf_benchmark_fails_without_udp_report():
+    tcp = '20260101120000,10.0.0.2,40000,10.0.0.1,5001,3,0.0-10.0,125000000,100000000\n'
+
+    def client_run(command):
+        return ('20260101120000,10.0.0.2,40000,10.0.0.1,5001,3,0.0-10.0,12500000,10000000\n'
+                if ' -u ' in command else tcp), 0
+
+    benchmark = TestGroup.IperfBenchmark('10.0.0.1', server_run=lambda command: ('', 0), client_run=client_run)
+    benchmark.start_server = lambda lifetime: None
+    with pytest.raises(AssertionError, match='no UDP server report'):
+        benchmark.run(50, duration=1)
+
+
+@pytest.fixture
+def listeners():
+    """Local TCP listener and UDP echo server, and a closed port of each protocol."""
+    tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    tcp.bind(('127.0.0.1', 0))
+    tcp.listen(16)
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp.bind(('127.0.0.1', 0))
+    closed = []
+    for kind in (socket.SOCK_STREAM, socket.SOCK_DGRAM):
+        with socket.socket(socket.AF_INET, kind) as s:
+            s.bind(('127.0.0.1', 0))
+            closed.append(s.getsockname()[1])
+
+    def echo():
+        while True:
+            try:
+                data, addr = udp.recvfrom(1024)
+                udp.sendto(data, addr)
+            except OSError:
+                return
+
+    threading.Thread(target=echo, daemon=True).start()
+    yield {'tcp': tcp.getsockname()[1], 'udp': udp.getsockname()[1], 'closed tcp': closed[0],
+           'closed udp': closed[1]}
+    tcp.close()
+    udp.close()
+
+
+@pytest.fixture
+def firewall_ports(monkeypatch, listeners):
+    monkeypatch.setattr(TestGroup, 'FIREWALL_PORTS', {
+        'web': [('tcp', listeners['tcp'])],
+        'iperf': [('udp', listeners['udp'])],
+        'internet': [],
+    })
+    monkeypatch.setattr(TestGroup, 'BLOCKED_PROBES', [('tcp', listeners['closed tcp']),
+                                                      ('udp', listeners['closed udp'])])
+    return listeners
+
+
+def test_expected_ports(firewall_ports):
+    allowed, blocked = TestGroup.expected_ports([('web', True), ('iperf', False), ('internet', True)])
+    assert allowed == {('tcp', firewall_ports['tcp'])}
+    assert blocked == {('udp', firewall_ports['udp']), ('tcp', firewall_ports['closed tcp']),
+                       ('udp', firewall_ports['closed udp'])}
+
+
+def test_verify_firewalls_matching_rules(firewall_ports):
+    result = TestGroup.verify_firewalls({'127.0.0.1': [('web', True), ('iperf', True)]}, timeout=1.0)['127.0.0.1']
+    assert result['Ports']['tcp/%d' % firewall_ports['tcp']] == 'open'
+    assert result['Ports']['udp/%d' % firewall_ports['udp']] == 'open'
+    assert result['Ports']['tcp/%d' % firewall_ports['closed tcp']] == 'closed'
+    assert result['Mismatches'] == []
+
+
+def test_verify_firewalls_reports_open_blocked_port(firewall_ports):
+    result = TestGroup.verify_firewalls({'127.0.0.1': [('web', False), ('iperf', True)]}, timeout=1.0)['127.0.0.1']
+    assert result['Mismatches'] == ['tcp/%d blocked, but open' % firewall_ports['tcp']]
+
+
+def fast_policies(attempts=3):
+    return [TestGroup.RetryPolicy('refused', (ConnectionRefusedError,), attempts, 0, 0)]
+
+
+def test_retry_engine_retries_until_success():
+    engine = TestGroup.RetryEngine(fast_policies())
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionRefusedError()
+        return 'ok'
+
+    assert engine.call('host', flaky) == 'ok'
+    stats = engine.stats()['host']
+    assert (stats['Calls'], stats['Succeeded'], stats['Retries']) == (1, 1, {'refused': 2})
+
+
+def test_retry_engine_does_not_retry_other_errors():
+    engine = TestGroup.RetryEngine(fast_policies())
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise ValueError('bug')
+
+    with pytest.raises(ValueError):
+        engine.call('host', broken)
+    assert len(calls) == 1
+
+
+def test_retry_engine_opens_circuit():
+    engine = TestGroup.RetryEngine(fast_policies(attempts=1), threshold=2, reset_timeout=60)
+
+    def refused():
+        raise ConnectionRefusedError()
+
+    for _ in range(2):
+        with pytest.raises(ConnectionRefusedError):
+            engine.call('host', refused)
+    with pytest.raises(TestGroup.CircuitOpenError):
+        engine.call('host', refused)
+    stats = engine.stats()['host']
+    assert (stats['Failed'], stats['Circuit opened'], stats['Rejected']) == (2, 1, 1)
+
+
+class FakeChannel:
+    """Channel of paramiko, which returns output in given chunks."""
+
+    def __init__(self, chunks, status=0):
+        self.chunks = list(chunks)
+        self.status = status
+        self.closed = False
+
+    def recv(self, size):
+        return self.chunks.pop(0) if self.chunks else b''
+
+    def recv_exit_status(self):
+        return self.status
+
+    def close(self):
+        self.closed = True
+
+
+def test_streaming_result_splits_chunks_into_lines():
+    channel = FakeChannel([b'Loaded plugins\r\nInstall', b'ing iperf\nComplete!', b'\nlast'], status=0)
+    closed = []
+    result = TestGroup.StreamingResult(channel, on_close=lambda: closed.append(True))
+    assert result.find('Installing') == 'Installing iperf'
+    assert result.wait() == 0
+    assert result.lines_read == 4
+    assert result.output() == 'Loaded plugins\nInstalling iperf\nComplete!\nlast'
+    assert channel.closed and closed == [True]
+
+
+def test_streaming_result_keeps_only_tail():
+    channel = FakeChannel([('line %d\n' % i).encode('utf-8') for i in range(100)], status=1)
+    result = TestGroup.StreamingResult(channel, keep_bytes=20)
+    assert result.wait() == 1
+    assert result.output() == '...\nline 98\nline 99'
+
+
+def test_streaming_result_without_channel():
+    result = TestGroup.StreamingResult(None)
+    assert result.readline() is None
+    assert result.wait() == -1
+
+
+class FakeGroup:
+    def test_pass(self):
+        print('\t...first step')
+        print('\t...second step')
+
+    def test_fail(self):
+        print('\t...first step')
+        assert 1 == 2, 'numbers differ'
+
+    def test_error(self):
+        raise RuntimeError('portal down')
+
+    def test_dependent(self):
+        pass
+
+
+def test_runner_records_steps_and_failures(capsys):
+    runner = TestGroup.TestRunner(FakeGroup(), dependencies={'test_dependent': ['test_fail']})
+    report = runner.run(['test_pass', 'test_fail', 'test_error', 'test_dependent'])
+    results = dict((result['Name'], result) for result in report['Tests'])
+    assert (report['Passed'], report['Failed'], report['Skipped']) == (1, 2, 1)
+    assert [step['Name'] for step in results['test_pass']['Steps']] == ['first step', 'second step']
+    assert results['test_fail']['Status'] == 'failed'
+    assert results['test_fail']['Steps'][-1]['Message'].startswith('AssertionError: numbers differ')
+    assert results['test_error']['Status'] == 'error'
+    assert results['test_dependent']['Skipped'] == 'test_fail did not pass'
+
+
+def test_runner_ignores_steps_of_other_threads(capsys):
+    class Group:
+        def test_threads(self):
+            thread = threading.Thread(target=lambda: print('\t...background step'))
+            thread.start()
+            thread.join()
+            print('\t...own step')
+
+    result = TestGroup.TestRunner(Group()).run_test('test_threads')
+    assert [step['Name'] for step in result['Steps']] == ['own step']
+    assert 'background step' in capsys.readouterr().out
+
+
+def test_runner_adds_cleanup_result():
+    runner = TestGroup.TestRunner(FakeGroup())
+    report = runner.run(['test_pass'])
+    report = runner.add(report, {'Name': 'cleanup', 'Status': 'error', 'Duration': 0.0, 'Steps': []})
+    assert (report['Passed'], report['Failed']) == (1, 1)
+
+
+class FakeElement:
+    def __init__(self, on_click=None, selected=False):
+        self.on_click = on_click
+        self.selected = selected
+
+    def click(self):
+        if self.on_click is not None:
+            self.on_click()
+
+    def is_selected(self):
+        return self.selected
+
+
+class FakePortal:
+    """WebDriver of the data center page: VM table and Power menu.
+    Rows are given as (VM id, name, status); every change bumps DOM version.
+    """
+
+    def __init__(self, rows):
+        self.rows = [{'Name': name, 'Href': 'https://portal/vm/%s' % vm_id, 'Status': status,
+                      'Selected': False, 'Public ip': ''} for vm_id, name, status in rows]
+        self.version = 0
+        self.snapshots = 0
+        self.clicks = []
+
+    def row(self, vm_id):
+        return next(row for row in self.rows if row['Href'].endswith('/' + vm_id))
+
+    def changed(self):
+        self.version += 1
+
+    def execute_script(self, script, *args):
+        if script == TestGroup.PageSnapshot.VERSION_SCRIPT:
+            return self.version
+        assert script == TestGroup.PageSnapshot.SCRIPT
+        self.snapshots += 1
+        return json.dumps({'Version': self.version, 'Url': 'https://portal/vm', 'Rows': self.rows,
+                           'Found': dict((needle, False) for needle in args[0])})
+
+    def find_element_by_xpath(self, xpath):
+        match = re.search(r"= '/(\w+)'\]\]/td/input$", xpath)
+        if match:
+            row = self.row(match.group(1))
+
+            def toggle():
+                self.clicks.append(match.group(1))
+                row['Selected'] = not row['Selected']
+                self.changed()
+
+            return FakeElement(toggle, row['Selected'])
+        if 'Power on' in xpath:
+            return FakeElement(self.power_on)
+        if "'Power'" in xpath:
+            return FakeElement()
+        raise LookupError(xpath)
+
+    def power_on(self):
+        for row in self.rows:
+            if row['Selected']:
+                row['Status'] = 'Powered on'
+        self.changed()
+
+
+def lifecycle(portal):
+    vms = TestGroup.VMInventory(portal, TestGroup.PageSnapshot(portal))
+    return vms, TestGroup.VMLifecycle(portal, vms, poll_interval=0.01)
+
+
+def test_transition_ignores_unrelated_duplicate_names():
+    portal = FakePortal([('1', 'Ubuntu-1410', 'Powered off'), ('2', 'TEST_VM_01', 'Powered off'),
+                         ('3', 'TEST_VM_01', 'Powered off')])
+    portal.rows[1]['Selected'] = True
+    vms, machines = lifecycle(portal)
+    machines.ensure_state('Ubuntu-1410', 'on', deadline=5)
+    assert portal.clicks == ['2', '1']
+    assert [row['Status'] for row in portal.rows] == ['Powered on', 'Powered off', 'Powered off']
+    assert [(m['VM Name'], m['From'], m['To']) for m in machines.metrics] == [('Ubuntu-1410', 'off', 'on')]
+
+
+def test_duplicate_name_is_refused():
+    portal = FakePortal([('2', 'TEST_VM_01', 'Powered off'), ('3', 'TEST_VM_01', 'Powered off')])
+    vms, machines = lifecycle(portal)
+    assert 'TEST_VM_01' in vms and vms.duplicates() == {'TEST_VM_01'}
+    assert sorted(record.vm_id for record in vms.records()) == ['2', '3']
+    with pytest.raises(TestGroup.DuplicateVMNameError):
+        machines.ensure_state('TEST_VM_01', 'on', deadline=1)
+    assert portal.clicks == []
+
+
+class FakeSession:
+    """Session of TestGroup, which wraps the given driver and real Remote."""
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def wrap(self, name, factory):
+        return self.driver if name == 'driver' else factory()
+
+
+def test_sweep_destroys_orphans_by_id_only(tmp_path):
+    portal = FakePortal([('7', 'Ubuntu-1410', 'Powered off'), ('8', 'TEST_VM_01', 'Powered on')])
+    crashed = TestGroup.RunLedger(str(tmp_path / 'ledger.json'), run_tag='crashed')
+    crashed.add('Ubuntu-1410')
+    crashed.identify('Ubuntu-1410', '7')
+    # Gone already, the live TEST_VM_01 belongs to another runner
+    crashed.add('TEST_VM_01')
+    crashed.identify('TEST_VM_01', '5')
+    crashed.add('CentOS-7')
+    group = TestGroup.TestGroup('user@example.com', 'secret', 'https://portal',
+                                TestGroup.RunLedger(str(tmp_path / 'ledger.json')), FakeSession(portal))
+    destroyed = []
+
+    def delete_vms(ids=()):
+        # As delete_vms does, ids not in the table are skipped
+        destroyed.extend(vm_id for vm_id in ids if group.vms.by_id(vm_id) is not None)
+        portal.rows = [row for row in portal.rows if row['Href'].rpartition('/')[2] not in ids]
+        portal.changed()
+        return destroyed
+
+    group.delete_vms = delete_vms
+    group.sweep_orphans(max_age=0)
+    assert destroyed == ['7']
+    assert [row['Name'] for row in portal.rows] == ['TEST_VM_01']
+    assert crashed.entries() == []
+
+
+def test_ledger_orphans_of_other_runs(tmp_path):
+    path = str(tmp_path / 'ledger.json')
+    live, crashed = TestGroup.RunLedger(path), TestGroup.RunLedger(path, run_tag='crashed')
+    live.add('Ubuntu-1410')
+    crashed.add('Ubuntu-1410')
+    crashed.identify('Ubuntu-1410', '7')
+    live.identify('Ubuntu-1410', '9')
+    assert [(e['Run'], e['VM id']) for e in live.orphans(max_age=0)] == [('crashed', '7')]
+    live.discard(live.orphans(max_age=0))
+    assert [e['VM id'] for e in live.entries()] == ['9']
+
+
+class FakeKeyStore:
+    def __init__(self, public_key):
+        self.key = public_key
+
+    def public_key(self):
+        return self.key
+
+
+class FakeForm:
+    """WebDriver of the create form, remembers typed keys."""
+
+    def __init__(self):
+        self.typed = []
+
+    def find_element_by_xpath(self, xpath):
+        form = self
+
+        class Field:
+            def send_keys(self, *values):
+                form.typed.extend(values)
+
+        return Field()
+
+
+def type_runner_key(driver, remote):
+    driver.find_element_by_xpath("//*[self::input or self::textarea][contains(@name, 'ssh_key')]"). \
+        send_keys(remote.public_key())
+
+
+def test_replay_types_recorded_runner_key(tmp_path):
+    path = str(tmp_path / 'run.jsonl')
+    recorder = TestGroup.Recorder(path)
+    form = FakeForm()
+    type_runner_key(recorder.wrap('driver', lambda: form),
+                    recorder.wrap('remote', lambda: TestGroup.Remote(FakeKeyStore('ecdsa AAAA recorded'))))
+    recorder.close()
+    assert form.typed == ['ecdsa AAAA recorded']
+
+    # Replay has its own (scratch) keystore with another key
+    player = TestGroup.Player(path)
+    type_runner_key(player.wrap('driver', FakeForm), player.wrap('remote', lambda: FakeKeyStore('ecdsa BBBB')))
+    assert player.position == len(player.entries)
+
+
+def test_scratch_store_without_encryption(tmp_path):
+    store = TestGroup.CredentialStore(str(tmp_path / 'store'), encrypted=False)
+    store.add_credentials('Ubuntu-1410', 'root', 'secret')
+    store.bind('10.0.0.5', 'Ubuntu-1410')
+    assert store.host('10.0.0.5') == {'VM Name': 'Ubuntu-1410', 'Host key': None, 'Password': 'secret',
+                                      'Key auth': []}
+
+
+class BadHostKeyException(Exception):
+    pass
+
+
+class FakeSSH:
+    """paramiko client, which records commands and answers them with status 0."""
+    connected = []
+    output = [b'done\n']
+
+    def __init__(self):
+        self.commands = []
+        self.policy = None
+        self.closed = False
+
+    def get_host_keys(self):
+        return {}
+
+    def set_missing_host_key_policy(self, policy):
+        self.policy = policy
+
+    def connect(self, hostname, **kwargs):
+        if hostname == '10.0.0.66':
+            raise BadHostKeyException('Host key for server 10.0.0.66 does not match')
+        FakeSSH.connected.append(self)
+
+    def exec_command(self, command):
+        self.commands.append(command)
+        return None, types.SimpleNamespace(channel=FakeChannel(self.output)), None
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_paramiko(monkeypatch):
+    monkeypatch.setattr(TestGroup, 'client', types.SimpleNamespace(SSHClient=FakeSSH, AutoAddPolicy=lambda: 'auto'))
+    monkeypatch.setattr(TestGroup, 'paramiko', types.SimpleNamespace(BadHostKeyException=BadHostKeyException))
+    monkeypatch.setattr(TestGroup, 'ssh_exception', types.SimpleNamespace(SSHException=IOError))
+    FakeSSH.connected = []
+
+
+class SSHKeyStore(FakeKeyStore):
+    """Keystore of hosts given as address -> VM name."""
+
+    def __init__(self, hosts):
+        FakeKeyStore.__init__(self, 'ecdsa AAAA runner')
+        self.hosts = hosts
+        self.authorized = []
+
+    def host(self, address):
+        return {'VM Name': self.hosts.get(address), 'Host key': None, 'Password': 'secret', 'Key auth': []}
+
+    def key_auth(self, address, username):
+        self.authorized.append((address, username))
+
+    def missing_host_key(self, ssh, hostname, key):
+        pass
+
+
+def test_runner_key_is_pushed_to_own_vms_only(fake_paramiko):
+    keystore = SSHKeyStore({'10.0.0.5': 'Ubuntu-1410'})
+    TestGroup.connect_ssh('10.0.0.5', 'root', keystore=keystore)
+    TestGroup.connect_ssh('192.0.2.1', 'admin', keystore=keystore)
+    own, other = FakeSSH.connected
+    assert own.policy is keystore and 'authorized_keys' in own.commands[0]
+    assert other.policy == 'auto' and other.commands == []
+    assert keystore.authorized == [('10.0.0.5', 'root')]
+
+
+def test_single_commands_survive_host_key_mismatch(fake_paramiko):
+    keystore = SSHKeyStore({'10.0.0.66': 'CentOS-7'})
+    assert TestGroup.send_single_command('10.0.0.66', 'root', 'secret', 'uptime', keystore=keystore) == ('', -1)
+    result = TestGroup.stream_single_command('10.0.0.66', 'root', 'secret', 'uptime', keystore=keystore)
+    assert result.wait() == -1
+
+
+class FakeWait:
+    """WebDriverWait, which polls without sleeping."""
+
+    def __init__(self, driver, timeout, poll_frequency=0.5):
+        self.driver = driver
+
+    def until(self, condition):
+        for _ in range(100):
+            value = condition(self.driver)
+            if value:
+                return value
+        raise AssertionError('condition not met')
+
+
+class FakeEditPage:
+    """WebDriver of the reconfigure page, states are served in order."""
+
+    def __init__(self, states):
+        self.states = [{'Ready': True, 'Pending': pending, 'Requests': requests} for pending, requests in states]
+        self.polls = 0
+        self.edits = []
+
+    def execute_script(self, script, *args):
+        if script == TestGroup.EditPage.EDIT_SCRIPT:
+            self.edits.append(args[0])
+            return {'Old': {'#f_input_vcpus': '1'}, 'Changed': True}
+        self.polls += 1
+        return self.states[min(self.polls, len(self.states)) - 1]
+
+
+def test_edit_waits_until_estimation_settles(monkeypatch):
+    monkeypatch.setattr(TestGroup, 'ui', types.SimpleNamespace(WebDriverWait=FakeWait))
+    # Before edit, estimation, idle between estimations, follow-up estimation
+    driver = FakeEditPage([(0, 0), (1, 1), (0, 1), (1, 2), (0, 2)])
+    old = TestGroup.EditPage(driver).edit({'#f_input_vcpus': '2'})
+    assert old == {'#f_input_vcpus': '1'}
+    assert driver.edits == [{'#f_input_vcpus': '2'}]
+    assert driver.polls == 6
+
+
+def test_edit_without_estimation_request(monkeypatch):
+    monkeypatch.setattr(TestGroup, 'ui', types.SimpleNamespace(WebDriverWait=FakeWait))
+    driver = FakeEditPage([(0, 0)])
+    TestGroup.EditPage(driver, start_polls=4).edit({'#f_input_vcpus': '2'})
+    assert driver.polls == 1 + 5
+
+
+class FakeQuotaPage:
+    """WebDriver of a portal page, which reports the quota in a page global."""
+
+    def __init__(self, quota):
+        self.quota = quota
+        self.found = []
+
+    def execute_script(self, script, *args):
+        assert script == TestGroup.AdmissionController.QUOTA_SCRIPT
+        return json.dumps(self.quota) if self.quota is not None else None
+
+    def find_element_by_xpath(self, xpath):
+        self.found.append(xpath)
+        raise LookupError(xpath)
+
+
+def test_admission_reservations(tmp_path, monkeypatch):
+    monkeypatch.delenv('TESTGROUP_QUOTA', raising=False)
+    page = FakeQuotaPage({'vcpus': {'limit': 4, 'used': 1}})
+    admission = TestGroup.AdmissionController(page, 'user@example.com', str(tmp_path / 'admission.json'))
+    admission.admit('Ubuntu-1410', {'vCPU': 2})
+    with pytest.raises(TestGroup.QuotaExceededError, match='not enough vCPU'):
+        admission.admit('CentOS-7', {'vCPU': 2}, deadline=0)
+    # The page counts the created VM in usage, its reservation is dropped
+    admission.created('Ubuntu-1410')
+    page.quota['vcpus']['used'] = 3
+    with pytest.raises(TestGroup.QuotaExceededError):
+        admission.admit('CentOS-7', {'vCPU': 2}, deadline=0)
+    page.quota['vcpus']['used'] = 1
+    admission.admit('CentOS-7', {'vCPU': 2})
+    with pytest.raises(TestGroup.QuotaExceededError, match='quota is 4'):
+        admission.admit('Big', {'vCPU': 8})
+
+
+def test_admission_keeps_uncounted_reservations(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv('TESTGROUP_QUOTA', 'vCPU=4')
+    admission = TestGroup.AdmissionController(FakeQuotaPage(None), 'user@example.com',
+                                              str(tmp_path / 'admission.json'))
+    admission.admit('Ubuntu-1410', {'vCPU': 3})
+    admission.created('Ubuntu-1410')
+    # Usage is unknown: the created VM still holds its vCPUs, even after TTL
+    admission.reservation_ttl = 0
+    with pytest.raises(TestGroup.QuotaExceededError):
+        admission.admit('CentOS-7', {'vCPU': 2}, deadline=0)
+    admission.release('Ubuntu-1410')
+    admission.admit('CentOS-7', {'vCPU': 2})
+
+    monkeypatch.delenv('TESTGROUP_QUOTA')
+    assert admission.quota() == {}
+    assert 'admission control disabled' in capsys.readouterr().out
+
+
+def test_configure_vm_admits_before_filling_the_form(tmp_path, monkeypatch):
+    monkeypatch.delenv('TESTGROUP_QUOTA', raising=False)
+    page = FakeQuotaPage({'vcpus': 2})
+    group = TestGroup.TestGroup('user@example.com', 'secret', 'https://portal',
+                                TestGroup.RunLedger(str(tmp_path / 'ledger.json')), FakeSession(page))
+    group.admission.path = str(tmp_path / 'admission.json')
+    with pytest.raises(TestGroup.QuotaExceededError):
+        group.configure_vm({'VM Name': 'Ubuntu-1410', 'vCPU': 4, 'RAM': 2048, 'HDD 1 Size': 20})
+    assert page.found == []
+
+
+def test_update_json_serializes_writers(tmp_path):
+    path = str(tmp_path / 'counter.json')
+
+    def increment():
+        for _ in range(50):
+            TestGroup.update_json(path, threading.Lock(), lambda d: d.__setitem__('N', d.get('N', 0) + 1),
+                                  default=dict)
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert TestGroup.update_json(path, threading.Lock(), dict, default=dict, shared=True) == {'N': 200}
+
+
+def test_update_json_shared_read_and_encoding(tmp_path):
+    path = tmp_path / 'store'
+    lock = threading.Lock()
+    assert TestGroup.update_json(str(path), lock, len, shared=True) == 0
+    assert not path.exists()
+    TestGroup.update_json(str(path), lock, lambda entries: entries.append('a'),
+                          encode=lambda content: content[::-1], decode=lambda content: content[::-1])
+    assert path.read_bytes() == b'[\n "a"\n]'[::-1]
+    assert TestGroup.update_json(str(path), lock, list, shared=True, decode=lambda content: content[::-1]) == ['a']
+
+
+def test_power_transition_latency_is_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(TestGroup.PROGRESS, 'durations_path', str(tmp_path / 'durations.json'))
+    portal = FakePortal([('1', 'Ubuntu-1410', 'Powered off')])
+    group = TestGroup.TestGroup('user@example.com', 'secret', 'https://portal',
+                                TestGroup.RunLedger(str(tmp_path / 'ledger.json')), FakeSession(portal))
+    group.lifecycle.poll_interval = 0.01
+    group.test_power = lambda: group.lifecycle.ensure_state('Ubuntu-1410', 'on', deadline=5)
+    report = group.run_tests(['test_power'])
+    assert report['Passed'] == 1
+    assert [(m['VM Name'], m['From'], m['To']) for m in report['Lifecycle']] == [('Ubuntu-1410', 'off', 'on')]
+    assert 'testgroup_vm_transition_seconds{from="off",to="on",vm="Ubuntu-1410"}' in TestGroup.PROGRESS.prometheus()
+
+    TestGroup.save_junit(report, str(tmp_path / 'report.xml'))
+    assert 'name="transition 01 Ubuntu-1410: off -&gt; on"' in (tmp_path / 'report.xml').read_text()
+
+
+def test_single_command_keeps_only_output_tail(fake_paramiko, monkeypatch):
+    monkeypatch.setattr(FakeSSH, 'output', [('line %d\n' % i).encode('utf-8') for i in range(10000)])
+    data, status = TestGroup.send_single_command('192.0.2.1', 'root', 'secret', 'yum -y install fio',
+                                                 keystore=SSHKeyStore({}), keep_bytes=20)
+    assert (data, status) == ('...\nline 9998\nline 9999', 0)
+    assert FakeSSH.connected[0].closed
+
+
+def test_replay_saves_retry_stats_next_to_report(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(TestGroup.PROGRESS, 'durations_path', str(tmp_path / 'durations.json'))
+    monkeypatch.setattr(TestGroup, 'TIME_SCALE', TestGroup.TIME_SCALE)
+    recording = tmp_path / 'empty.jsonl'
+    recording.write_text('')
+    report = str(tmp_path / 'report')
+    with pytest.raises(SystemExit) as exit_info:
+        TestGroup.main(['run', '--replay', str(recording), '--tests', 'test_firewall', '--report', report,
+                        'user@example.com', 'secret', 'https://portal'])
+    assert exit_info.value.code == 0
+    assert json.loads((tmp_path / 'report.json').read_text())['Passed'] == 1
+    assert isinstance(json.loads((tmp_path / 'report.retries.json').read_text()), dict)
+
+
+class FakeCoordinator:
+    """Coordinator, which records jobs and reports them passed."""
+    jobs = []
+
+    def __init__(self, jobs, workers=2, min_interval=30, max_concurrent=1, timeout=3600):
+        FakeCoordinator.jobs = jobs
+
+    def run(self):
+        return {'Started': 0.0, 'Duration': 0.0, 'Passed': len(self.jobs), 'Failed': 0,
+                'Jobs': [dict(job, Status='passed', Retries={}) for job in self.jobs]}
+
+
+def test_isolated_run_takes_the_scenario(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(TestGroup, 'Coordinator', FakeCoordinator)
+    with pytest.raises(SystemExit) as exit_info:
+        TestGroup.main(['run', '--isolated', '--scenario', 'centos', '--report', str(tmp_path / 'report'),
+                        'user@example.com', 'secret', 'https://portal'])
+    assert exit_info.value.code == 0
+    assert [job['Scenario'] for job in FakeCoordinator.jobs] == ['centos']
+    assert json.loads((tmp_path / 'report.retries.json').read_text()) == {'centos': {}}
+
+
+@pytest.mark.parametrize('options', [['--tests', 'test_011'], ['--metrics-port', '9100']])
+def test_isolated_run_rejects_options_of_one_process(options, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        TestGroup.main(['run', 'user@example.com', 'secret', 'https://portal', '--isolated'] + options)
+    assert exit_info.value.code == 2
+    assert 'does not work with --isolated' in capsys.readouterr().err
+
+
+def test_coordinator_jobs_from_file(tmp_path):
+    path = tmp_path / 'jobs.json'
+    path.write_text(json.dumps({
+        'Accounts': [{'Email': 'a@example.com', 'Password': 'x', 'Regions': {'eu': 'https://eu', 'us': 'https://us'}},
+                     {'Email': 'b@example.com', 'Password': 'y', 'Regions': {'eu': 'https://eu'}}],
+        'Scenarios': ['ubuntu', 'centos'], 'Max concurrent': 2, 'Timeout': 60}))
+    coordinator = TestGroup.Coordinator.from_file(str(path), workers=3)
+    assert [(job['Email'], job['Region'], job['Scenario']) for job in coordinator.jobs] == [
+        ('a@example.com', 'eu', 'ubuntu'), ('a@example.com', 'eu', 'centos'), ('a@example.com', 'us', 'ubuntu'),
+        ('a@example.com', 'us', 'centos'), ('b@example.com', 'eu', 'ubuntu'), ('b@example.com', 'eu', 'centos')]
+    assert (coordinator.workers, coordinator.min_interval, coordinator.max_concurrent, coordinator.timeout) == \
+        (3, 30, 2, 60)
+
+
+def hang(job):
+    time.sleep(60)
+
+
+def fake_job(job):
+    return {'Email': job['Email'], 'Region': job['Region'], 'Scenario': job['Scenario'], 'Status': 'passed',
+            'Started': time.time(), 'Duration': 0.0}
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='workers must inherit the fake job')
+@pytest.mark.parametrize('job_runner, status', [(fake_job, 'passed'), (hang, 'timeout')])
+def test_coordinator_workers(job_runner, status, monkeypatch, capsys):
+    monkeypatch.setattr(TestGroup, 'run_job', job_runner)
+    jobs = [{'Email': 'a@example.com', 'Password': 'x', 'Region': region, 'Address': 'https://portal',
+             'Scenario': 'ubuntu'} for region in ('eu', 'us')]
+    report = TestGroup.Coordinator(jobs, workers=2, min_interval=0, max_concurrent=1, timeout=1).run()
+    assert sorted(job['Region'] for job in report['Jobs']) == ['eu', 'us']
+    assert set(job['Status'] for job in report['Jobs']) == {status}
+
+
+def test_snapshot_is_cached_until_dom_changes():
+    portal = FakePortal([('1', 'TEST_VM_01', 'Powered off')])
+    page = TestGroup.PageSnapshot(portal)
+    assert page.get()['Rows'][0]['Name'] == 'TEST_VM_01'
+    assert page.get() is page.get()
+    assert portal.snapshots == 1
+    portal.changed()
+    page.get()
+    assert portal.snapshots == 2
+    page.invalidate()
+    page.get()
+    assert portal.snapshots == 3
+
+
+def test_snapshot_looks_up_new_texts_once():
+    portal = FakePortal([])
+    page = TestGroup.PageSnapshot(portal, ['Logout'])
+    assert page.contains('Logout') is False
+    assert portal.snapshots == 1
+    assert page.contains('Data center') is False
+    assert page.contains('Data center') is False
+    assert page.needles == ['Logout', 'Data center']
+    assert portal.snapshots == 2
+
+
+def test_inventory_looks_up_exact_names():
+    portal = FakePortal([('1', 'TEST_VM_010', 'Powered on'), ('2', 'TEST_VM_01', 'Powered off')])
+    vms, machines = lifecycle(portal)
+    assert vms['TEST_VM_01'].vm_id == '2'
+    assert vms['TEST_VM_010'].vm_id == '1'
+    assert 'TEST_VM_0' not in vms
+    assert vms.get('TEST_VM_0') is None
+    assert vms.by_id('1').name == 'TEST_VM_010'
+    assert vms.by_id('3') is None
+    assert vms.names() == ['TEST_VM_010', 'TEST_VM_01']
+
+
+def test_inventory_keeps_records_of_unchanged_rows():
+    portal = FakePortal([('1', 'TEST_VM_01', 'Powered off'), ('2', 'TEST_VM_02', 'Powered off')])
+    vms, machines = lifecycle(portal)
+    record = vms['TEST_VM_01']
+    portal.rows[0]['Status'] = 'Powered on'
+    portal.rows.pop(1)
+    portal.changed()
+    assert vms['TEST_VM_01'] is record
+    assert record.status == 'Powered on'
+    assert 'TEST_VM_02' not in vms
+    assert [r.vm_id for r in vms.records()] == ['1']
+
+
+def select_and_read(driver):
+    vms = TestGroup.VMInventory(driver, TestGroup.PageSnapshot(driver))
+    vms['TEST_VM_01'].select()
+    return [(record.vm_id, record.name, record.selected) for record in vms.records()]
+
+
+def test_record_and_replay_round_trip(tmp_path):
+    path = str(tmp_path / 'session.jsonl')
+    portal = FakePortal([('1', 'TEST_VM_01', 'Powered off'), ('2', 'TEST_VM_02', 'Powered on')])
+    recorder = TestGroup.Recorder(path)
+    recorded = select_and_read(recorder.wrap('driver', lambda: portal))
+    recorder.close()
+    assert recorded == [('1', 'TEST_VM_01', True), ('2', 'TEST_VM_02', False)]
+    player = TestGroup.Player(path)
+    assert select_and_read(player.wrap('driver', None)) == recorded
+    assert player.position == len(player.entries)
+
+
+def test_replay_refuses_other_calls(tmp_path):
+    path = str(tmp_path / 'session.jsonl')
+    recorder = TestGroup.Recorder(path)
+    driver = recorder.wrap('driver', lambda: FakePortal([('1', 'TEST_VM_01', 'Powered off')]))
+    driver.find_element_by_xpath("//tr[td/a[substring(@href, string-length(@href) - 1) = '/1']]/td/input")
+    recorder.close()
+    with pytest.raises(TestGroup.ReplayMismatchError, match='called with'):
+        TestGroup.Player(path).wrap('driver', None).find_element_by_xpath(
+            "//tr[td/a[substring(@href, string-length(@href) - 1) = '/2']]/td/input")
+    with pytest.raises(TestGroup.ReplayMismatchError, match='expected driver.execute_script'):
+        TestGroup.Player(path).wrap('driver', None).execute_script(TestGroup.PageSnapshot.VERSION_SCRIPT)
+    player = TestGroup.Player(path)
+    player.wrap('driver', None).find_element_by_xpath(
+        "//tr[td/a[substring(@href, string-length(@href) - 1) = '/1']]/td/input")
+    with pytest.raises(TestGroup.ReplayMismatchError, match='over after 1 calls'):
+        player.wrap('driver', None).execute_script(TestGroup.PageSnapshot.VERSION_SCRIPT)